@@ -1,30 +1,43 @@
-import sys
-import subprocess
-
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-try:
-    import distutils.core
-except ImportError:
-    install('setuptools')
-    import distutils.core
+import time
+_import_start = time.time()
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import (Flask, render_template, request, jsonify, send_file, send_from_directory, url_for, redirect,
+                   Response, stream_with_context)
 import os
-import requests
-import tempfile
-from pydub import AudioSegment
-from vocal_parts_to_sheet_music import examine_audio_and_prediction, create_sheet_music, quantize_duration_extended
-import io
+import sys
+import json
+import gzip
+import math
+import threading
+from jobs import (job_queue, run_transcription_job, run_retune_job, QueueFullError, ServiceUnavailableError,
+                  ARTIFACT_TYPES, PROCESSING_MESSAGE, DONE, ERROR, admission_limit)
+from musicxml_writer import compress_musicxml
+from itunes_client import get_search_client, SearchError
+import mimetypes
+import static_assets
+from preprocessing import PREPROCESS_MODES, DEFAULT_PREPROCESS_MODE
+from inference_engine import ENGINES, DEFAULT_ENGINE
+from import_report import HEAVY_PACKAGES
+from telemetry import configure_logging, server_timing_header
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging; LOG_LEVEL and LOG_FORMAT=json control it
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# Send each finished job's stage timings as a Server-Timing header on its status response
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
 app = Flask(__name__, static_folder='static')
 
+# Each event stream holds a server thread for the life of its job. gunicorn.conf.py sizes the
+# thread pool above this limit; streams beyond it are refused and the page falls back to polling.
+event_streams = threading.BoundedSemaphore(admission_limit())
+
+# The inference stack is only imported by job workers; the web process should start without it
+logger.info("App imported in %.2f seconds; inference stack loaded: %s", time.time() - _import_start,
+            ', '.join(name for name in HEAVY_PACKAGES if name in sys.modules) or 'none')
+
 # Add CSP headers
 @app.after_request
 def add_header(response):
@@ -38,101 +51,266 @@ def index():
 
 @app.route('/search', methods=['POST'])
 def search_song():
-    query = request.json['query']
-    
-    search_url = f'https://itunes.apple.com/search?term={query}&entity=song&limit=1'
-    response = requests.get(search_url)
-    
-    if response.status_code == 200:
-        results = response.json()
-        if results['resultCount'] > 0:
-            track = results['results'][0]
-            return jsonify({
-                'title': track['trackName'],
-                'artist': track['artistName'],
-                'url': track['previewUrl']
-            })
-    
-    return jsonify({
-        'error': 'No results found'
-    }), 404
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    query = data.get('query')
+    if not isinstance(query, str):
+        query = ''
+    query = query.strip()
+    if not query:
+        return jsonify({'error': 'Search query is missing'}), 400
+    try:
+        limit = int(data.get('limit', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    client = get_search_client()
+    try:
+        results = client.search(query, limit)
+    except SearchError as e:
+        app.logger.warning("Search for %r failed: %s", query, e)
+        return jsonify({'error': 'Song search is unavailable right now. Please try again shortly.'}), 502
+
+    if not results:
+        return jsonify({
+            'error': 'No results found'
+        }), 404
+
+    # Most searches are followed by /process on the top result; have its audio ready
+    client.prefetch_preview(results[0]['url'])
+    # The top result stays at the top level for existing clients
+    return jsonify(dict(results[0], results=results))
 
 @app.route('/process', methods=['POST'])
 def process_audio():
     app.logger.debug("Processing audio request received")
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
     try:
-        data = request.json
         start_time = float(data.get('start_time', 0))
         end_time = float(data.get('end_time', 0))
-        audio_url = data.get('audio_url')
-
-        if not audio_url:
-            app.logger.error("Audio URL is missing")
-            return jsonify({'error': 'Audio URL is missing'}), 400
-
-        app.logger.debug(f"Downloading audio from {audio_url}")
-        response = requests.get(audio_url)
-        if response.status_code != 200:
-            app.logger.error(f"Failed to download audio. Status code: {response.status_code}")
-            return jsonify({'error': 'Failed to download audio'}), 400
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.m4a') as temp_file:
-            temp_file.write(response.content)
-            temp_file_path = temp_file.name
-
-        app.logger.debug(f"Audio saved to temporary file: {temp_file_path}")
-
-        app.logger.debug("Converting audio to WAV and extracting selected portion")
-        audio = AudioSegment.from_file(temp_file_path, format="m4a")
-        selected_audio = audio[int(start_time*1000):int(end_time*1000)]
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as wav_file:
-            selected_audio.export(wav_file.name, format="wav")
-            wav_file_path = wav_file.name
-
-        app.logger.debug(f"Selected audio saved to: {wav_file_path}")
-
-        app.logger.debug("Processing audio and generating sheet music")
-        processing_message = "Processing audio. This may take 30-60 seconds. Please wait..."
-        lead_midi = examine_audio_and_prediction(wav_file_path, skip_noise_reduction=True)
-        
-        if lead_midi:
-            musicxml = create_sheet_music(lead_midi, None, "memory", quantize_duration_extended, "processed", input_filename="processed.xml")
-            
-            # Generate MIDI file
-            midi_buffer = io.BytesIO()
-            lead_midi.write(midi_buffer)
-            midi_buffer.seek(0)
-            
-            app.logger.debug("Sheet music and MIDI generated successfully")
-            
-            # Clean up temporary files
-            os.unlink(temp_file_path)
-            os.unlink(wav_file_path)
-            
-            return jsonify({
-                'musicxml': musicxml,
-                'midi': midi_buffer.getvalue().hex(),  # Send MIDI data as hexadecimal string
-                'processing_message': processing_message
-            })
+    except (TypeError, ValueError):
+        return jsonify({'error': 'start_time and end_time must be numbers'}), 400
+    if not (math.isfinite(start_time) and math.isfinite(end_time)):
+        return jsonify({'error': 'start_time and end_time must be numbers'}), 400
+    # end_time 0 means to the end of the preview
+    if start_time < 0 or (end_time and end_time <= start_time):
+        return jsonify({'error': 'start_time must be at least 0 and before end_time'}), 400
+    audio_url = data.get('audio_url')
+    # Latency/quality tradeoff for the vocal filter; the full HPSS stays the default
+    preprocess_mode = data.get('preprocess_mode', DEFAULT_PREPROCESS_MODE)
+    # CREPE is a lighter pitch tracker for monophonic lead vocals
+    engine = data.get('engine', DEFAULT_ENGINE)
+
+    if not audio_url:
+        app.logger.error("Audio URL is missing")
+        return jsonify({'error': 'Audio URL is missing'}), 400
+
+    if preprocess_mode not in PREPROCESS_MODES:
+        return jsonify({'error': f"preprocess_mode must be one of {', '.join(PREPROCESS_MODES)}"}), 400
+
+    if engine not in ENGINES:
+        return jsonify({'error': f"engine must be one of {', '.join(ENGINES)}"}), 400
+
+    try:
+        job = job_queue.submit(run_transcription_job, audio_url, start_time, end_time, preprocess_mode, engine)
+    except QueueFullError as e:
+        app.logger.warning("Rejecting audio processing request: %s", e)
+        response = jsonify({'error': 'The server is busy processing other requests. Please try again shortly.'})
+        response.headers['Retry-After'] = '10'
+        return response, 429
+
+    app.logger.debug("Queued audio processing job %s", job.id)
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id),
+        'processing_message': PROCESSING_MESSAGE
+    }), 202
+
+def parse_bool(value):
+    # bool('false') is True; form and string clients send these
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', '1'):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ('false', '0'):
+        return False
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"expected true or false, got {value!r}")
+
+# Note extraction settings a client may change when re-tuning an existing transcription
+RETUNE_PARAMETERS = {
+    'onset_threshold': float,
+    'frame_threshold': float,
+    'minimum_note_length': float,
+    'melodia_trick': parse_bool,
+    'merge_max_gap': float,
+    'merge_min_duration': float,
+    'merge_pitch_tolerance': int,
+    # CREPE transcriptions only
+    'confidence_threshold': float,
+    # The selection of the analysed preview, as returned with the original result
+    'start_time': float,
+    'end_time': float,
+}
+
+@app.route('/retune', methods=['POST'])
+def retune_audio():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    analysis_id = data.get('analysis_id')
+    if not analysis_id:
+        return jsonify({'error': 'Analysis id is missing'}), 400
+
+    config = {}
+    for name, cast in RETUNE_PARAMETERS.items():
+        if name not in data:
+            continue
+        try:
+            config[name] = cast(data[name])
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid parameter {name}: {str(e)}'}), 400
+
+    try:
+        job = job_queue.submit(run_retune_job, analysis_id, config)
+    except QueueFullError as e:
+        app.logger.warning("Rejecting retune request: %s", e)
+        response = jsonify({'error': 'The server is busy processing other requests. Please try again shortly.'})
+        response.headers['Retry-After'] = '10'
+        return response, 429
+
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id)
+    }), 202
+
+@app.errorhandler(ServiceUnavailableError)
+def service_unavailable(e):
+    # Only raised in inference-service mode, when the service process can't be reached
+    app.logger.error("Inference service unavailable: %s", e)
+    response = jsonify({'error': 'The transcription service is temporarily unavailable. Please try again shortly.'})
+    response.headers['Retry-After'] = '10'
+    return response, 503
+
+def public_status(job_id, status):
+    # A finished result lists its artifacts by URL; ?format=inline restores the old shape, with the
+    # MusicXML and hex-encoded MIDI inside the JSON, for clients that expect it
+    if not status.get('result') or 'artifacts' not in status['result']:
+        return status
+    # Copied: locally the job queue hands out the job's own result dict
+    result = dict(status['result'])
+    status = dict(status, result=result)
+    if request.args.get('format') == 'inline':
+        result['musicxml'] = gzip.decompress(job_queue.artifact(job_id, 'musicxml')).decode('utf-8')
+        result['midi'] = job_queue.artifact(job_id, 'midi').hex()
+        del result['artifacts']
+    else:
+        names = list(result['artifacts']) + (['mxl'] if 'musicxml' in result['artifacts'] else [])
+        result['artifacts'] = {name: url_for('job_artifact', job_id=job_id, name=name) for name in names}
+    return status
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    status = job_queue.get(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    response = jsonify(public_status(job_id, status))
+    if SERVER_TIMING and status.get('timings'):
+        response.headers['Server-Timing'] = server_timing_header(status['timings'])
+    return response
+
+@app.route('/status/<job_id>/artifacts/<name>')
+def job_artifact(job_id, name):
+    # MusicXML is stored gzipped and sent as is to clients that accept gzip; .mxl is the zipped
+    # MusicXML container notation programs open directly
+    source = 'musicxml' if name == 'mxl' else name
+    data = job_queue.artifact(job_id, source) if source in ARTIFACT_TYPES else None
+    if data is None:
+        return jsonify({'error': 'Unknown artifact'}), 404
+
+    mimetype, gzipped = ARTIFACT_TYPES[source]
+    headers = {'Cache-Control': 'private, max-age=600'}
+    if name == 'mxl':
+        data = compress_musicxml(gzip.decompress(data))
+        mimetype = 'application/vnd.recordare.musicxml'
+        headers['Content-Disposition'] = 'attachment; filename="score.mxl"'
+    elif gzipped:
+        headers['Vary'] = 'Accept-Encoding'
+        if request.accept_encodings.best_match(['gzip']):
+            headers['Content-Encoding'] = 'gzip'
         else:
-            app.logger.error("Failed to process audio: No MIDI data generated")
-            # Clean up temporary files
-            os.unlink(temp_file_path)
-            os.unlink(wav_file_path)
-            return jsonify({'error': 'Failed to process audio: No MIDI data generated'}), 500
-    except Exception as e:
-        app.logger.exception("An error occurred during audio processing")
-        return jsonify({'error': str(e)}), 500
+            data = gzip.decompress(data)
+    return Response(data, mimetype=mimetype, headers=headers)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition; in inference-service mode the service owns the job metrics
+    return Response(job_queue.metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/status/<job_id>/events')
+def job_events(job_id):
+    # Server-sent events: one message per state/stage change until the job finishes
+    if not event_streams.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open event streams; poll the status URL instead'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    def stream():
+        version = -1
+        while True:
+            new_version = job_queue.wait_for_update(job_id, version)
+            if new_version is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+                return
+            status = job_queue.get(job_id)
+            if new_version == version or status is None:
+                # Keep-alive comment so proxies don't drop the idle connection
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps(public_status(job_id, status))}\n\n"
+            if status['state'] in (DONE, ERROR):
+                return
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, whether or not the stream ever started
+    response.call_on_close(event_streams.release)
+    return response
 
 @app.route('/midi/<path:filename>')
 def serve_midi(filename):
     return send_file(f'static/midi/{filename}', mimetype='audio/midi')
 
+@app.route('/assets/<path:path>')
+def serve_asset(path):
+    # Built, content-hashed files: cached for good, precompressed variants picked by Accept-Encoding,
+    # with ETags, conditional GETs and byte ranges from send_from_directory
+    filename, encoding = static_assets.negotiate(path, request.accept_encodings)
+    if filename is None:
+        return jsonify({'error': 'Unknown asset'}), 404
+    response = send_from_directory(static_assets.BUILD_DIR, filename, conditional=True,
+                                   etag=static_assets.etag(path, encoding),
+                                   mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['Cache-Control'] = static_assets.IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route('/static/soundfonts/<path:filename>')
 def serve_soundfont(filename):
-    app.logger.debug(f"Serving soundfont file: {filename}")
-    return send_file(f'static/soundfonts/{filename}', mimetype='application/javascript')
+    # Old unhashed URL: send clients to the cacheable copy when there is one
+    path = static_assets.asset_path(f'soundfonts/{filename}')
+    if path:
+        return redirect(url_for('serve_asset', path=path))
+    return send_from_directory('static/soundfonts', filename, conditional=True, mimetype='application/javascript')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,150 @@
+import struct
+import subprocess
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Sample rate the rest of the pipeline works at (librosa.load's default, and Basic Pitch's input rate)
+TARGET_SAMPLE_RATE = 22050
+
+DOWNLOAD_TIMEOUT = (5, 30)  # (connect, read) seconds
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+# Enough for the ftyp/moov header of an iTunes preview, so one request tells us the layout
+PROBE_BYTES = 64 * 1024
+# Extra audio fetched past the selection end so the decoder never runs dry mid-selection
+SEGMENT_MARGIN_SECONDS = 1.0
+
+
+class DownloadError(Exception):
+    pass
+
+
+_session = None
+
+
+def get_session():
+    # Shared keep-alive session: repeated preview downloads reuse pooled connections
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def mp4_layout(data):
+    # Walk the top-level MP4 boxes in `data`; returns (duration_seconds, mdat_offset) when the
+    # moov header precedes the media data (a "faststart" file), otherwise None
+    offset = 0
+    duration = None
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > len(data):
+                return None
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+
+        if box_type == b'moov':
+            duration = _mvhd_duration(data[offset + header:offset + size])
+        elif box_type == b'mdat':
+            return (duration, offset) if duration else None
+        if size < header:
+            return None
+        offset += size
+    return None
+
+
+def _mvhd_duration(moov):
+    offset = 0
+    while offset + 8 <= len(moov):
+        size, box_type = struct.unpack('>I4s', moov[offset:offset + 8])
+        if box_type == b'mvhd':
+            version = moov[offset + 8]
+            if version == 1:
+                timescale, duration = struct.unpack('>IQ', moov[offset + 28:offset + 40])
+            else:
+                timescale, duration = struct.unpack('>II', moov[offset + 20:offset + 28])
+            return duration / timescale if timescale else None
+        if size < 8:
+            return None
+        offset += size
+    return None
+
+
+def _read_limited(response, max_bytes):
+    chunks = []
+    total = 0
+    for chunk in response.iter_content(64 * 1024):
+        total += len(chunk)
+        if total > max_bytes:
+            response.close()
+            raise DownloadError(f"Audio is larger than the {max_bytes} byte limit")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _get_range(session, url, first, last, timeout, max_bytes):
+    response = session.get(url, headers={'Range': f'bytes={first}-{last}'}, timeout=timeout, stream=True)
+    if response.status_code not in (200, 206):
+        raise DownloadError(f"Failed to download audio. Status code: {response.status_code}")
+    return response, _read_limited(response, max_bytes)
+
+
+def fetch_audio(url, end_time=None, session=None, timeout=DOWNLOAD_TIMEOUT, max_bytes=MAX_DOWNLOAD_BYTES):
+    # Download only as much of the file as is needed to decode up to end_time.
+    # Falls back to the whole file when the server ignores Range or the layout is unknown.
+    session = session or get_session()
+    response, head = _get_range(session, url, 0, PROBE_BYTES - 1, timeout, max_bytes)
+    if response.status_code == 200:
+        return head
+
+    content_range = response.headers.get('Content-Range', '')
+    total = int(content_range.rsplit('/', 1)[1]) if '/' in content_range and not content_range.endswith('*') else None
+    if total is not None and len(head) >= total:
+        return head
+
+    last = total - 1 if total is not None else ''
+    layout = mp4_layout(head)
+    if layout and end_time and total is not None:
+        duration, mdat_offset = layout
+        # AAC previews are close to constant bitrate, so byte position tracks time
+        fraction = min(1.0, (end_time + SEGMENT_MARGIN_SECONDS) / duration)
+        last = min(total - 1, mdat_offset + int((total - mdat_offset) * fraction))
+        if last < len(head):
+            return head
+
+    if total is not None and last + 1 > max_bytes:
+        raise DownloadError(f"Audio is larger than the {max_bytes} byte limit")
+    _, rest = _get_range(session, url, len(head), last, timeout, max_bytes - len(head))
+    return head + rest
+
+
+def decode_audio_bytes(data, start_time=None, end_time=None, format=None, sr=TARGET_SAMPLE_RATE):
+    # Decode only the selected range with ffmpeg input seeking, straight to mono float32 at sr
+    command = ['ffmpeg', '-v', 'error']
+    if start_time:
+        command += ['-ss', str(start_time)]
+    if end_time:
+        command += ['-t', str(end_time - (start_time or 0))]
+    if format:
+        command += ['-f', 'mp4' if format == 'm4a' else format]
+    # A faststart MP4 (or any non-MP4 stream) decodes sequentially from a plain pipe. Only an MP4
+    # with its moov box at the end needs ffmpeg's cache: protocol, which spools stdin to a temp file
+    # so the demuxer can seek.
+    needs_seek = format in ('m4a', 'mp4') and mp4_layout(data) is None
+    command += ['-i', 'cache:pipe:0' if needs_seek else 'pipe:0',
+                '-vn', '-ac', '1', '-ar', str(sr), '-f', 'f32le', 'pipe:1']
+
+    process = subprocess.run(command, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # A range-fetched file is deliberately truncated; ffmpeg may complain about the missing tail
+    # after it has decoded everything we asked for, so only fail when nothing came out
+    if not process.stdout:
+        raise RuntimeError(f"Decoding failed: {process.stderr.decode(errors='ignore')}")
+    return np.frombuffer(process.stdout, dtype=np.float32).copy(), sr
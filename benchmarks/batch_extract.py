@@ -0,0 +1,155 @@
+"""Compare the old extract-then-cut flow with batch, segment-only extraction.
+
+Serves synthetic 3-minute songs (MP3, and AAC in a faststart MP4) from a
+local Range-capable HTTP server standing in for the remote site. Every
+response is delayed to mimic a remote round trip and throttled to a
+per-connection bandwidth, so what a client stops reading early is never sent.
+Each item is extracted three ways:
+
+  old          download the whole file, transcode it to a 192k MP3, cut with ffmpeg -t, one at a time
+  sequential   extract_audio.py batch mode with --jobs 1: ffmpeg reads only the section, writes WAV
+  concurrent   the same with --jobs N
+
+For each mode it reports wall time and the KB served. Needs ffmpeg on PATH.
+
+    python benchmarks/batch_extract.py --items 8 --jobs 4 --latency-ms 50 --mbit 40
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extract_audio import parse_batch_file, extract_batch
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    files = {}
+    latency = 0.0
+    bytes_per_second = None
+    bytes_sent = 0
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        time.sleep(self.latency)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else len(data) - 1
+            body = data[first:last + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{first + len(body) - 1}/{len(data)}')
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        # Counted per chunk: ffmpeg drops the connection once it has what it needs, or to seek
+        for offset in range(0, len(body), 64 * 1024):
+            chunk = body[offset:offset + 64 * 1024]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            with MediaHandler._lock:
+                MediaHandler.bytes_sent += len(chunk)
+            if self.bytes_per_second:
+                time.sleep(len(chunk) / self.bytes_per_second)
+
+    def log_message(self, *args):
+        pass
+
+
+def synthetic_song(path, seconds, codec):
+    args = ['-c:a', 'libmp3lame', '-b:a', '192k'] if codec == 'mp3' else ['-c:a', 'aac', '-b:a', '192k',
+                                                                          '-movflags', '+faststart']
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'sine=frequency=330:duration={seconds}',
+                    '-ac', '2', *args, path], check=True)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def old_extract(item, output_dir):
+    # What extract_audio() did per item: fetch everything, transcode to MP3, then cut
+    name = os.path.basename(item['url'])
+    source = os.path.join(output_dir, name)
+    with open(source, 'wb') as f:
+        f.write(requests.get(item['url'], timeout=30).content)
+    mp3 = os.path.join(output_dir, f'{name}.mp3')
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', source, '-b:a', '192k', mp3], check=True)
+    cut = os.path.join(output_dir, f'{name}_cut.mp3')
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-ss', str(item['start']), '-i', mp3,
+                    '-t', str(item['duration']), '-acodec', 'copy', cut], check=True)
+    return cut
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=8)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--song-seconds', type=int, default=180)
+    parser.add_argument('--start', type=float, default=60.0)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--mbit', type=float, default=40.0, help="Bandwidth per connection, in Mbit/s")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for codec, extension in (('mp3', 'mp3'), ('aac', 'm4a')):
+            MediaHandler.files[f'/song.{extension}'] = synthetic_song(
+                os.path.join(temp_dir, f'song.{extension}'), args.song_seconds, codec)
+        MediaHandler.latency = args.latency_ms / 1000
+        MediaHandler.bytes_per_second = args.mbit * 1e6 / 8
+        server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # Alternate formats; the start moves per item so every output file is distinct
+        batch_file = os.path.join(temp_dir, 'batch.txt')
+        with open(batch_file, 'w') as f:
+            f.write('# url start duration\n')
+            for i in range(args.items):
+                extension = ('mp3', 'm4a')[i % 2]
+                f.write(f"http://127.0.0.1:{server.server_port}/song.{extension} {args.start + i} {args.duration}\n")
+        items = parse_batch_file(batch_file)
+
+        print(f"{'mode':<11} {'seconds':>8} {'KB served':>10}")
+        for mode in ('old', 'sequential', 'concurrent'):
+            output_dir = os.path.join(temp_dir, mode)
+            os.makedirs(output_dir)
+            MediaHandler.bytes_sent = 0
+            start = time.perf_counter()
+            if mode == 'old':
+                for item in items:
+                    old_extract(item, output_dir)
+            else:
+                with open(os.devnull, 'w') as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        results = extract_batch(items, output_dir, 1 if mode == 'sequential' else args.jobs)
+                    finally:
+                        sys.stdout = stdout
+                failed = [result for result in results if 'error' in result]
+                if failed:
+                    raise RuntimeError(failed[0]['error'])
+                info = sf.info(results[0]['output'])
+            elapsed = time.perf_counter() - start
+            print(f"{mode:<11} {elapsed:>8.2f} {MediaHandler.bytes_sent / 1024:>10.0f}")
+        print(f"WAV output: {info.samplerate} Hz, {info.channels} channel(s), {info.duration:.2f} seconds")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
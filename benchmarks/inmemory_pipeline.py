@@ -0,0 +1,119 @@
+"""Compare the old temp-file round trips in /process with the in-memory pipeline.
+
+Only the I/O-bound stages are timed (decode + slice, handing audio to
+preprocessing and inference, and MusicXML serialization); HPSS and the model
+run identically in both modes and are left out. Bytes written to storage are
+read from /proc/self/io (write_bytes, which unlike wchar ignores pipes to
+ffmpeg), so they are only reported on Linux.
+
+    python benchmarks/inmemory_pipeline.py --seconds 30 --repeat 5
+"""
+import os
+import sys
+import io
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+import librosa
+import pretty_midi
+import music21 as m21
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_io import decode_audio_bytes
+from vocal_parts_to_sheet_music import create_part_from_midi, quantize_duration_extended
+
+
+def disk_bytes_written():
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['write_bytes'])
+    except OSError:
+        return 0
+
+
+def synthetic_wav_bytes(seconds, sr=44100):
+    t = np.arange(int(seconds * sr)) / sr
+    pitches = 60 + (np.floor(t * 2) % 12)
+    y = 0.3 * np.sin(2 * np.pi * np.cumsum(440 * 2 ** ((pitches - 69) / 12)) / sr)
+    buffer = io.BytesIO()
+    sf.write(buffer, np.stack([y, y], axis=1), sr, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+
+def synthetic_score(seconds):
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(0)
+    for i in range(int(seconds * 2)):
+        instrument.notes.append(pretty_midi.Note(100, 60 + i % 12, i * 0.5, i * 0.5 + 0.45))
+    midi.instruments.append(instrument)
+    score = m21.stream.Score()
+    part = create_part_from_midi(midi, "Lead Vocal", quantize_duration_extended)
+    part.makeMeasures(inPlace=True)
+    score.append(part)
+    return score
+
+
+def run_disk(data, start_time, end_time, score):
+    # The pre-refactor path: every stage hands the next one a file
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
+        temp_file.write(data)
+    audio = AudioSegment.from_file(temp_file.name, format='wav')
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as wav_file:
+        audio[int(start_time * 1000):int(end_time * 1000)].export(wav_file.name, format='wav')
+    y, sr = librosa.load(wav_file.name)
+    highpass_path = wav_file.name.replace('.wav', '_highpass.wav')
+    sf.write(highpass_path, y, sr)
+    preprocessed_path = wav_file.name.replace('.wav', '_preprocessed.wav')
+    sf.write(preprocessed_path, y, sr)
+    y, sr = librosa.load(preprocessed_path, sr=22050)
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as xml_file:
+        score.write('musicxml', xml_file.name)
+    with open(xml_file.name) as f:
+        musicxml = f.read()
+    for path in (temp_file.name, wav_file.name, highpass_path, preprocessed_path, xml_file.name):
+        os.unlink(path)
+    return y, musicxml
+
+
+def run_memory(data, start_time, end_time, score):
+    y, sr = decode_audio_bytes(data, start_time, end_time, format='wav')
+    musicxml = m21.musicxml.m21ToXml.GeneralObjectExporter(score).parse().decode('utf-8')
+    return y, musicxml
+
+
+def measure(fn, repeat, *args):
+    times, written_bytes = [], []
+    for _ in range(repeat):
+        written = disk_bytes_written()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+        written_bytes.append(disk_bytes_written() - written)
+    return np.median(times), np.median(written_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=30.0, help='length of the synthetic preview')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = synthetic_wav_bytes(args.seconds)
+    start_time, end_time = args.seconds * 0.25, args.seconds * 0.75
+    score = synthetic_score(end_time - start_time)
+    # Warm up imports and caches so the first mode measured isn't penalized
+    run_memory(data, start_time, end_time, score)
+
+    print(f"{'mode':<8} {'median s':>10} {'written MB':>11}")
+    for name, fn in (('disk', run_disk), ('memory', run_memory)):
+        elapsed, written_bytes = measure(fn, args.repeat, data, start_time, end_time, score)
+        print(f"{name:<8} {elapsed:>10.3f} {written_bytes / 1e6:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Exercise the /search client against a local stub of the iTunes Search API.
+
+The stub answers searches after a fixed delay, like the real API's round trip,
+and serves a synthetic AAC preview for every result. Reported:
+
+  typing      a query typed letter by letter, then retyped: upstream calls and
+              total time, uncached (a fresh requests.get per search, as before)
+              vs SearchClient
+  burst       N identical searches at once: upstream calls (coalesced to one)
+  prefetch    time until the top result's preview is in the preview cache,
+              and loading it from there vs downloading it
+
+Needs ffmpeg on PATH.
+
+    python benchmarks/itunes_search.py --latency-ms 150 --burst 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from range_fetch import RangeHandler, synthetic_preview
+
+
+class ITunesStub(RangeHandler):
+    latency = 0.15
+    searches = 0
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/preview/'):
+            return super().do_GET()
+        with ITunesStub._lock:
+            ITunesStub.searches += 1
+        time.sleep(self.latency)
+        params = parse_qs(url.query)
+        term = params['term'][0]
+        limit = int(params.get('limit', ['1'])[0])
+        host = f"http://{self.headers['Host']}"
+        results = [{'trackName': f"{term.title()} {i}", 'artistName': 'Stub Artist', 'collectionName': 'Stub Album',
+                    'previewUrl': f"{host}/preview/{abs(hash((term, i)))}.m4a"} for i in range(limit)]
+        body = json.dumps({'resultCount': len(results), 'results': results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=150.0)
+    parser.add_argument('--burst', type=int, default=16)
+    parser.add_argument('--query', default='billie jean')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['PREVIEW_CACHE_DIR'] = temp_dir
+        from itunes_client import SearchClient
+        from transcription_cache import get_preview_cache
+        from audio_io import fetch_audio
+
+        ITunesStub.latency = args.latency_ms / 1000
+        RangeHandler.payload = synthetic_preview()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ITunesStub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}/search"
+
+        # Each prefix as it's typed, then the whole thing typed again
+        typed = [args.query[:i] for i in range(1, len(args.query) + 1) if args.query[i - 1] != ' '] * 2
+        print(f"{'scenario':<22} {'searches':>8} {'upstream':>8} {'seconds':>8}")
+
+        ITunesStub.searches = 0
+        start = time.perf_counter()
+        for query in typed:
+            requests.get(base_url, params={'term': query, 'entity': 'song', 'limit': 1}).json()
+        print(f"{'typing, uncached':<22} {len(typed):>8} {ITunesStub.searches:>8} {time.perf_counter() - start:>8.2f}")
+
+        client = SearchClient(base_url, prefetch=False)
+        ITunesStub.searches = 0
+        start = time.perf_counter()
+        for query in typed:
+            client.search(query.upper() if len(query) % 2 else query)
+        print(f"{'typing, SearchClient':<22} {len(typed):>8} {ITunesStub.searches:>8} {time.perf_counter() - start:>8.2f}")
+
+        client = SearchClient(base_url, prefetch=False)
+        ITunesStub.searches = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.burst) as executor:
+            results = list(executor.map(lambda _: client.search(args.query, limit=5), range(args.burst)))
+        assert all(result == results[0] for result in results) and len(results[0]) == 5
+        print(f"{'burst, SearchClient':<22} {args.burst:>8} {ITunesStub.searches:>8} {time.perf_counter() - start:>8.2f}")
+
+        client = SearchClient(base_url)
+        start = time.perf_counter()
+        url = client.search(args.query + ' live')[0]['url']
+        client.prefetch_preview(url)
+        searched = time.perf_counter() - start
+        while url not in get_preview_cache():
+            time.sleep(0.005)
+        ready = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cached = get_preview_cache().get(url)
+        from_cache = time.perf_counter() - start
+        start = time.perf_counter()
+        downloaded = fetch_audio(url)
+        from_network = time.perf_counter() - start
+        assert cached == downloaded
+        print(f"\nsearch returned after {searched * 1000:.0f} ms; preview cached {ready * 1000:.0f} ms after the search started")
+        print(f"preview load: cache {from_cache * 1000:.1f} ms vs download {from_network * 1000:.1f} ms "
+              f"({len(cached) / 1024:.0f} KB)")
+        print(f"client stats: {client.stats()}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
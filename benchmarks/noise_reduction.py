@@ -0,0 +1,109 @@
+"""Compare the old nn_filter noise reduction with the spectral gate in preprocessing.py.
+
+Both reducers run on the same synthetic "vocal" (a stepped melody with a few
+harmonics) buried in white noise, at 15 s, 90 s and full-song length. The old
+call ran nn_filter on the raw waveform, which builds a sample-by-sample
+recurrence matrix, so it runs in a child process with a time and memory
+limit and is reported as timed out / out of memory when it hits them. SNR is
+measured against the clean signal.
+
+    python benchmarks/noise_reduction.py --durations 15 90 240 --timeout 120 --max-memory-mb 3000
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+import librosa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import spectral_gate
+
+SR = 22050
+
+
+def synthetic_vocal(seconds, sr=SR, noise_level=0.03, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    # Half-second notes wandering around a C major scale, with breaths between phrases
+    scale = np.array([60, 62, 64, 65, 67, 69, 71, 72])
+    pitches = scale[rng.integers(0, len(scale), int(np.ceil(seconds * 2)) + 1)][(t * 2).astype(int)]
+    phase = 2 * np.pi * np.cumsum(440 * 2 ** ((pitches - 69) / 12)) / sr
+    clean = sum(0.3 / k * np.sin(k * phase) for k in range(1, 4))
+    clean *= (t % 4) < 3.5
+    noisy = clean + noise_level * rng.standard_normal(len(t))
+    return clean.astype(np.float32), noisy.astype(np.float32)
+
+
+def snr(clean, estimate):
+    return 10 * np.log10(np.sum(clean ** 2) / np.sum((estimate - clean) ** 2))
+
+
+def legacy_nn_filter(y, sr):
+    # The previous preprocess_audio call, verbatim
+    return librosa.decompose.nn_filter(y, aggregate=np.median, metric='cosine', width=int(sr / 2))
+
+
+def _run_limited(fn_name, clean, noisy, max_memory_mb, results):
+    if max_memory_mb:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    fn = {'nn_filter': legacy_nn_filter, 'spectral_gate': spectral_gate}[fn_name]
+    if fn_name == 'spectral_gate':
+        # Pay librosa's first-call JIT compilation outside the timed run
+        fn(noisy[:2 * SR], SR)
+    try:
+        start = time.perf_counter()
+        out = fn(noisy, SR)
+        # Only send back scalars: a large array in the queue would block the child from exiting
+        results.put(('ok', time.perf_counter() - start, snr(clean, out)))
+    except MemoryError:
+        results.put(('out of memory', None, None))
+    except Exception as e:
+        results.put((f'error: {type(e).__name__}', None, None))
+
+
+def measure(fn_name, clean, noisy, timeout, max_memory_mb):
+    # Each run gets a fresh process so a runaway nn_filter can't take the benchmark down with it
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_limited, args=(fn_name, clean, noisy, max_memory_mb, results))
+    process.start()
+    try:
+        result = results.get(timeout=timeout)
+    except queue.Empty:
+        result = (f'timed out (>{timeout:.0f} s)' if process.is_alive()
+                  else f'killed (exit code {process.exitcode})', None, None)
+    process.kill()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durations', type=float, nargs='+', default=[15, 90, 240],
+                        help='clip lengths in seconds; the last one stands in for a full song')
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-run limit for each reducer')
+    parser.add_argument('--max-memory-mb', type=int, default=3000, help='address-space limit per run')
+    parser.add_argument('--skip-nn-filter', action='store_true')
+    args = parser.parse_args()
+
+    methods = ['spectral_gate'] if args.skip_nn_filter else ['nn_filter', 'spectral_gate']
+    print(f"{'seconds':>8} {'method':<14} {'time s':>10} {'x realtime':>11} {'SNR in':>7} {'SNR out':>8}")
+    for seconds in args.durations:
+        clean, noisy = synthetic_vocal(seconds)
+        for method in methods:
+            status, elapsed, snr_out = measure(method, clean, noisy, args.timeout, args.max_memory_mb)
+            if status != 'ok':
+                print(f"{seconds:>8.0f} {method:<14} {status}")
+                continue
+            print(f"{seconds:>8.0f} {method:<14} {elapsed:>10.3f} {seconds / elapsed:>11.1f} "
+                  f"{snr(clean, noisy):>7.1f} {snr_out:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Compare the old per-object note merge with the array-backed note table.
+
+The legacy path is the pre-refactor merge_nearby_notes loop plus the pitch
+histogram walk, run over pretty_midi.Note objects; the new path is
+note_table.merge_notes plus the bincount histogram. Key detection is left out
+(both sides get the same C major scale) so only the note handling is timed.
+Both outputs are checked for equality before timing. "stored" is the memory
+the notes themselves occupy; "peak" is the extra working memory of one merge.
+
+The "held" rows are the vectorized merge's worst case: one sustained note
+followed by a run of short notes that only join it through each other, so
+every pass settles one more link and the merge falls back to the sequential
+walk.
+
+    python benchmarks/note_merge.py --notes 1000 5000 20000 100000 --polyphony 1 4
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pretty_midi
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from note_table import Transcription, merge_notes, pitch_class_histogram
+
+SCALE = [0, 2, 4, 5, 7, 9, 11]
+
+
+def legacy_merge(midi_data, scale_pitches, max_gap=0.15, min_duration=0.075, pitch_tolerance=1):
+    for instrument in midi_data.instruments:
+        merged_notes = []
+        current_note = None
+        for note in instrument.notes:
+            if current_note is None:
+                current_note = note
+            elif (abs(note.pitch - current_note.pitch) <= pitch_tolerance and
+                  note.start - current_note.end <= max_gap):
+                current_note.end = max(current_note.end, note.end)
+                current_note.velocity = max(current_note.velocity, note.velocity)
+                if note.pitch % 12 in scale_pitches and current_note.pitch % 12 not in scale_pitches:
+                    current_note.pitch = note.pitch
+            else:
+                if current_note.end - current_note.start >= min_duration:
+                    merged_notes.append(current_note)
+                current_note = note
+        if current_note is not None and current_note.end - current_note.start >= min_duration:
+            merged_notes.append(current_note)
+        instrument.notes = [note for note in merged_notes
+                            if note.pitch % 12 in scale_pitches or note.end - note.start > 0.5]
+
+    pitch_hist = np.zeros(12)
+    for instrument in midi_data.instruments:
+        for note in instrument.notes:
+            pitch_hist[note.pitch % 12] += note.end - note.start
+    return midi_data, pitch_hist / np.sum(pitch_hist)
+
+
+def array_merge(transcription, scale_pitches):
+    merged = transcription.with_notes(merge_notes(transcription.notes, scale_pitches))
+    return merged, pitch_class_histogram(merged)
+
+
+def synthetic_midi(n_notes, polyphony, seed=0):
+    # Notes at roughly polyphony * 4 onsets per second, short and clustered around a tenor range
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.uniform(0, n_notes / (4 * polyphony), n_notes))
+    ends = starts + rng.exponential(0.2, n_notes)
+    pitches = rng.integers(55, 75, n_notes)
+    velocities = rng.integers(30, 128, n_notes)
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(program=4)
+    instrument.notes = [pretty_midi.Note(int(v), int(p), float(s), float(e))
+                        for s, e, p, v in zip(starts, ends, pitches, velocities)]
+    midi.instruments.append(instrument)
+    return midi
+
+
+def held_note_midi(n_notes):
+    # A note held under the whole line, then short notes 0.2 s apart: each is too far from the
+    # previous short note on its own, but starts before the held note's end once they're merged
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(program=4)
+    instrument.notes = [pretty_midi.Note(100, 60, 0.0, 0.25 * n_notes + 1.0)]
+    instrument.notes += [pretty_midi.Note(100, 60 + i % 2, 0.25 * i, 0.25 * i + 0.05) for i in range(1, n_notes)]
+    midi.instruments.append(instrument)
+    return midi
+
+
+def measure(fn, make_input, repeat):
+    # Timed without tracemalloc, whose per-allocation hook would penalize the object-heavy path
+    times = []
+    for _ in range(repeat):
+        data = make_input()
+        start = time.perf_counter()
+        fn(data, SCALE)
+        times.append(time.perf_counter() - start)
+
+    data = make_input()
+    tracemalloc.start()
+    fn(data, SCALE)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return np.median(times), peak
+
+
+def stored_bytes(make):
+    tracemalloc.start()
+    kept = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, nargs='+', default=[1000, 5000, 20000, 100000])
+    parser.add_argument('--polyphony', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--held', type=int, nargs='+', default=[1000, 4000, 10000],
+                        help="Note counts for the held-note worst case")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'notes':>7} {'poly':>5} {'legacy ms':>10} {'array ms':>9} {'speedup':>8} "
+          f"{'legacy stored KB':>17} {'array stored KB':>16} {'legacy peak KB':>15} {'array peak KB':>14}")
+    cases = [(n_notes, polyphony, synthetic_midi(n_notes, polyphony))
+             for n_notes in args.notes for polyphony in args.polyphony]
+    cases += [(n_notes, 'held', held_note_midi(n_notes)) for n_notes in args.held]
+    for n_notes, polyphony, midi in cases:
+        transcription = Transcription.from_pretty_midi(midi)
+
+        legacy, _ = legacy_merge(copy.deepcopy(midi), SCALE)
+        merged, _ = array_merge(transcription, SCALE)
+        assert ([(n.start, n.end, n.pitch, n.velocity) for n in legacy.instruments[0].notes] ==
+                merged.notes[['start', 'end', 'pitch', 'velocity']].tolist())
+
+        legacy_time, legacy_peak = measure(legacy_merge, lambda: copy.deepcopy(midi), args.repeat)
+        array_time, array_peak = measure(array_merge, lambda: transcription, args.repeat)
+        legacy_stored = stored_bytes(lambda: copy.deepcopy(midi))
+        array_stored = stored_bytes(lambda: Transcription.from_pretty_midi(midi))
+        print(f"{n_notes:>7} {polyphony:>5} {legacy_time * 1000:>10.2f} {array_time * 1000:>9.2f} "
+              f"{legacy_time / array_time:>7.1f}x {legacy_stored / 1024:>17.0f} {array_stored / 1024:>16.0f} "
+              f"{legacy_peak / 1024:>15.0f} {array_peak / 1024:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Compare sequential and process-pool transcription of several vocal stems.
+
+Synthetic stems are written to a fresh temporary directory for every run, and
+the transcription caches are kept in memory, so each run preprocesses and runs
+the model from scratch. With N stems on a host with at least N cores, the pool
+should take about as long as the slowest single stem.
+
+    python benchmarks/parallel_stems.py --stems 2 --seconds 30 --repeat 2
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+os.environ['TRANSCRIPTION_CACHE_BACKEND'] = 'memory'
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vocal_parts_to_sheet_music import transcribe_stems, _transcribe_stem
+
+CONFIG = {"merge_max_gap": 0.15, "merge_min_duration": 0.075, "merge_pitch_tolerance": 1}
+
+
+def write_stem(path, base_pitch, seconds, seed, sr=22050):
+    # A stepwise line at two notes a second over a little noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    steps = rng.choice([0, 2, 4, 5, 7, 9, 11, 12], int(seconds * 2) + 1)
+    pitches = base_pitch + steps[(t * 2).astype(int)]
+    y = 0.3 * np.sin(2 * np.pi * np.cumsum(440 * 2 ** ((pitches - 69) / 12)) / sr)
+    sf.write(path, y + 0.01 * rng.standard_normal(len(y)), sr)
+
+
+def write_stems(directory, n_stems, seconds):
+    paths = []
+    for i in range(n_stems):
+        path = os.path.join(directory, f"stem{i}.wav")
+        write_stem(path, 64 - 5 * i, seconds, seed=i)
+        paths.append(path)
+    return paths
+
+
+@contextlib.contextmanager
+def quiet():
+    # Pipeline progress goes to stdout/stderr, in the pool workers too; silence it at the fd level
+    sys.stdout.flush()
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+
+
+def run(mode, n_stems, seconds):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_stems(directory, n_stems, seconds)
+        start = time.perf_counter()
+        if mode == 'sequential':
+            results = [_transcribe_stem(path, CONFIG) for path in paths]
+        else:
+            results = transcribe_stems(paths, CONFIG, max_workers=n_stems)
+        elapsed = time.perf_counter() - start
+    return elapsed, [len(result) if result is not None else 0 for result in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stems', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{args.stems} stems of {args.seconds:.0f} s on {os.cpu_count()} cores")
+    print(f"{'mode':<11} {'median s':>9} {'notes':>12}")
+    for mode in ('sequential', 'pool'):
+        times = []
+        for _ in range(args.repeat):
+            with quiet():
+                elapsed, notes = run(mode, args.stems, args.seconds)
+            times.append(elapsed)
+        print(f"{mode:<11} {np.median(times):>9.2f} {str(notes):>12}")
+
+
+if __name__ == '__main__':
+    main()
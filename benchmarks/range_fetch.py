@@ -0,0 +1,90 @@
+"""Compare full-preview download + decode with Range fetch + segment-only decode.
+
+Serves a synthetic 30 s AAC preview from a local Range-capable HTTP server
+standing in for the iTunes CDN, then fetches and decodes a selection both
+ways. Needs ffmpeg on PATH.
+
+    python benchmarks/range_fetch.py --start 2 --end 8
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_io import fetch_audio, decode_audio_bytes
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    payload = b''
+    bytes_sent = 0
+
+    def do_GET(self):
+        data = self.payload
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else len(data) - 1
+            body = data[first:last + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{first + len(body) - 1}/{len(data)}')
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(body)
+        RangeHandler.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def synthetic_preview(seconds=30):
+    # The MP4 muxer needs a seekable output to write a faststart header, so go through a file
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'preview.m4a')
+        subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+                        '-c:a', 'aac', '-b:a', '256k', '-movflags', '+faststart', path], check=True)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--start', type=float, default=2.0)
+    parser.add_argument('--end', type=float, default=8.0)
+    args = parser.parse_args()
+
+    RangeHandler.payload = synthetic_preview()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/preview.m4a'
+
+    print(f"{'mode':<8} {'seconds':>8} {'KB fetched':>11} {'samples':>9}")
+    for name in ('full', 'range'):
+        RangeHandler.bytes_sent = 0
+        start = time.perf_counter()
+        if name == 'full':
+            data = requests.get(url, timeout=10).content
+            y, sr = decode_audio_bytes(data, format='m4a')
+            y = y[int(args.start * sr):int(args.end * sr)]
+        else:
+            data = fetch_audio(url, args.end)
+            y, sr = decode_audio_bytes(data, args.start, args.end, format='m4a')
+        elapsed = time.perf_counter() - start
+        print(f"{name:<8} {elapsed:>8.3f} {RangeHandler.bytes_sent / 1024:>11.1f} {len(y):>9}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare the old all-in-JSON job result with status JSON plus artifact downloads.
+
+The old result carried the MusicXML string and hex-encoded MIDI inside the
+status JSON, sent uncompressed. Now the status JSON only lists artifact URLs,
+the MusicXML is sent gzipped and the MIDI as raw bytes. Bytes on the wire and
+the time to parse what arrives (json.loads, plus gunzip for the new format,
+which browsers do natively) are reported for synthetic transcriptions.
+
+    python benchmarks/result_payload.py --notes 200 1000 5000
+"""
+import os
+import sys
+import io
+import gzip
+import json
+import time
+import argparse
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sheet_music_render import synthetic_transcription
+from vocal_parts_to_sheet_music import create_sheet_music, quantize_duration_extended
+
+METADATA = {'analysis_id': 'f' * 64, 'key_candidates': [{'name': 'C major', 'score': 0.9}] * 3,
+            'processing_message': 'Processing audio.'}
+
+
+def median_time(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, nargs='+', default=[200, 1000, 5000])
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'notes':>6} {'old KB':>8} {'new KB':>8} {'ratio':>6} {'old parse ms':>13} {'new parse ms':>13}")
+    for n_notes in args.notes:
+        transcription = synthetic_transcription(n_notes)
+        musicxml = create_sheet_music(transcription, None, "memory", quantize_duration_extended, '')
+        midi_buffer = io.BytesIO()
+        transcription.write(midi_buffer)
+        midi = midi_buffer.getvalue()
+
+        old = json.dumps({'state': 'done', 'result': dict(METADATA, musicxml=musicxml, midi=midi.hex())})
+        status = json.dumps({'state': 'done', 'result': dict(METADATA, artifacts={
+            'musicxml': '/status/0123456789abcdef0123456789abcdef/artifacts/musicxml',
+            'midi': '/status/0123456789abcdef0123456789abcdef/artifacts/midi',
+            'mxl': '/status/0123456789abcdef0123456789abcdef/artifacts/mxl'})})
+        musicxml_gz = gzip.compress(musicxml.encode('utf-8'), compresslevel=6, mtime=0)
+
+        old_bytes = len(old.encode('utf-8'))
+        new_bytes = len(status.encode('utf-8')) + len(musicxml_gz) + len(midi)
+        old_parse = median_time(lambda: json.loads(old)['result']['musicxml'])
+        new_parse = median_time(lambda: (json.loads(status), gzip.decompress(musicxml_gz).decode('utf-8')))
+        print(f"{n_notes:>6} {old_bytes / 1024:>8.0f} {new_bytes / 1024:>8.0f} {old_bytes / new_bytes:>6.1f} "
+              f"{old_parse * 1000:>13.2f} {new_parse * 1000:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""Benchmark the full transcription pipeline stage by stage on synthetic vocals.
+
+Sung-like melodies (harmonics, vibrato, percussive clicks and a little noise)
+of 15 s, 90 s and 5 min are generated locally with known notes and key, encoded
+like an iTunes preview, and run through decode -> HPSS -> Basic Pitch -> note
+creation -> merge_nearby_notes -> detect_key -> create_sheet_music, calling
+each stage directly so no cache is involved. Every stage records wall time, CPU
+time and peak RSS (reset between stages through /proc/self/clear_refs on
+Linux; elsewhere the process high-water mark is reported). Note-level
+precision/recall/F1 against the ground truth (onset within 50 ms, same pitch)
+and whether the key was found are tracked next to the timings.
+
+Results are compared with a stored baseline and regressions are flagged; the
+exit status is 1 if any were found.
+
+    python benchmarks/run_benchmarks.py --durations 15 90 300
+    python benchmarks/run_benchmarks.py --save-baseline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_io import decode_audio_bytes, TARGET_SAMPLE_RATE
+from preprocessing import apply_preprocessing, PREPROCESS_MODES, DEFAULT_PREPROCESS_MODE
+from inference_engine import get_engine
+from transcription_cache import quantize_activations
+from key_analysis import analyze_key
+from vocal_parts_to_sheet_music import (merge_nearby_notes, detect_key, create_sheet_music,
+                                        quantize_duration_extended)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STAGES = ('decode', 'hpss', 'basic_pitch', 'note_creation', 'merge', 'detect_key', 'render')
+
+# A C major melody between A3 and E5, so the expected key is known
+SCALE = np.array([0, 2, 4, 5, 7, 9, 11])
+EXPECTED_KEY = 'C major'
+ONSET_TOLERANCE = 0.05
+
+# Regressions smaller than these are measurement noise, whatever the relative change
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 20
+
+
+def synthetic_melody(seconds, seed):
+    # Ground-truth notes as (start, end, midi pitch), back to back with short breaths between
+    rng = np.random.default_rng(seed)
+    notes = []
+    t = 0.25
+    while True:
+        duration = rng.choice([0.25, 0.5, 0.75, 1.0, 1.5])
+        if t + duration > seconds - 0.25:
+            break
+        # Tonic-heavy so key detection has something to find
+        degree = rng.choice(7, p=[0.3, 0.1, 0.15, 0.08, 0.22, 0.07, 0.08])
+        pitch = 60 + SCALE[degree] + 12 * rng.choice([-1, 0, 0, 1], p=[0.2, 0.35, 0.35, 0.1])
+        # Fold into range by octaves so the pitch class (and the key) is preserved
+        pitch = int(pitch + 12 if pitch < 57 else pitch - 12 if pitch > 76 else pitch)
+        notes.append((t, t + duration, pitch))
+        t += duration + rng.choice([0.0, 0.05, 0.1, 0.2])
+    return notes
+
+
+def synthesize(notes, seconds, seed, sr=TARGET_SAMPLE_RATE):
+    # Harmonic voice with 5.5 Hz vibrato after the attack, plus hi-hat-like clicks and noise
+    rng = np.random.default_rng(seed)
+    y = np.zeros(int(seconds * sr), dtype=np.float64)
+    harmonics = np.arange(1, 9)
+    harmonic_gains = 1.0 / harmonics ** 1.5
+    for start, end, pitch in notes:
+        i0, i1 = int(start * sr), int(end * sr)
+        t = np.arange(i1 - i0) / sr
+        vibrato = 0.3 * np.sin(2 * np.pi * 5.5 * t) * np.clip((t - 0.15) / 0.2, 0, 1)
+        f0 = 440 * 2 ** ((pitch + vibrato - 69) / 12)
+        phase = 2 * np.pi * np.cumsum(f0) / sr
+        envelope = np.minimum(1, np.minimum(t / 0.03, (t[-1] - t) / 0.05 + 0.05))
+        voice = (harmonic_gains[:, None] * np.sin(harmonics[:, None] * phase)).sum(axis=0)
+        y[i0:i1] += 0.25 * envelope * voice
+    clicks = np.arange(0, seconds, 0.5)
+    click = rng.standard_normal(int(0.01 * sr)) * np.exp(-np.arange(int(0.01 * sr)) / (0.002 * sr))
+    for onset in clicks:
+        i = int(onset * sr)
+        y[i:i + len(click)] += 0.1 * click[:len(y) - i]
+    y += 0.003 * rng.standard_normal(len(y))
+    return (y / np.abs(y).max() * 0.8).astype(np.float32)
+
+
+def encode(y, sr, format):
+    # Encoded like the iTunes previews the app decodes; encoding isn't timed. MP4 needs a
+    # seekable output for faststart, so go through a temporary file.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"signal.{format}")
+        codec = ['-c:a', 'aac', '-b:a', '256k', '-movflags', '+faststart'] if format == 'm4a' else []
+        process = subprocess.run(['ffmpeg', '-v', 'error', '-f', 'f32le', '-ar', str(sr), '-ac', '1', '-i', 'pipe:0']
+                                 + codec + [path], input=y.tobytes(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise RuntimeError(f"Encoding failed: {process.stderr.decode(errors='ignore')}")
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def _read_status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{field} not in /proc/self/status")
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    try:
+        return _read_status('VmHWM')
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class StageRecorder:
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        self.stages[name] = {'wall_s': time.perf_counter() - wall,
+                             'cpu_s': time.process_time() - cpu,
+                             'peak_rss_mb': peak_rss() / 1e6}
+
+
+def note_accuracy(truth, estimated, onset_tolerance=ONSET_TOLERANCE):
+    # One-to-one matching of same-pitch notes whose onsets are within the tolerance, closest first
+    truth = np.asarray([(start, pitch) for start, _, pitch in truth], dtype=np.float64).reshape(-1, 2)
+    estimated = np.asarray(estimated, dtype=np.float64).reshape(-1, 2)
+    distance = np.abs(truth[:, None, 0] - estimated[None, :, 0])
+    candidates = (distance <= onset_tolerance) & (truth[:, None, 1] == estimated[None, :, 1])
+    rows, cols = np.nonzero(candidates)
+    matched_truth, matched_estimated = set(), set()
+    for k in np.argsort(distance[rows, cols], kind='stable'):
+        if rows[k] not in matched_truth and cols[k] not in matched_estimated:
+            matched_truth.add(rows[k])
+            matched_estimated.add(cols[k])
+    matches = len(matched_truth)
+    precision = matches / len(estimated) if len(estimated) else 0.0
+    recall = matches / len(truth) if len(truth) else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if matches else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1,
+            'notes_expected': len(truth), 'notes_found': len(estimated)}
+
+
+def run_pipeline(data, format, preprocess_mode):
+    recorder = StageRecorder()
+    engine = get_engine()
+    with recorder.stage('decode'):
+        y, sr = decode_audio_bytes(data, format=format)
+    with recorder.stage('hpss'):
+        y, _ = apply_preprocessing(y, sr, preprocess_mode)
+    with recorder.stage('basic_pitch'):
+        activations = quantize_activations(engine.run_model(y, sr))
+    with recorder.stage('note_creation'):
+        _, midi_data, _ = engine.notes_from_output(activations)
+    with recorder.stage('merge'):
+        transcription = merge_nearby_notes(midi_data)
+    with recorder.stage('detect_key'):
+        detect_key(transcription)
+    with recorder.stage('render'):
+        create_sheet_music(transcription, None, "memory", quantize_duration_extended, '')
+    # Memoized by detect_key
+    return recorder.stages, transcription, analyze_key(transcription)[0].name
+
+
+def benchmark(seconds, format, preprocess_mode, repeat):
+    notes = synthetic_melody(seconds, seed=int(seconds))
+    data = encode(synthesize(notes, seconds, seed=int(seconds)), TARGET_SAMPLE_RATE, format)
+
+    runs = []
+    # The pipeline narrates every step on stdout/stderr; keep the report readable
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        for _ in range(repeat):
+            stages, transcription, key = run_pipeline(data, format, preprocess_mode)
+            runs.append(stages)
+
+    # Median time over repeats; the largest peak RSS
+    stages = {name: {'wall_s': float(np.median([run[name]['wall_s'] for run in runs])),
+                     'cpu_s': float(np.median([run[name]['cpu_s'] for run in runs])),
+                     'peak_rss_mb': max(run[name]['peak_rss_mb'] for run in runs)}
+              for name in STAGES}
+    estimated = np.stack([transcription.notes['start'], transcription.notes['pitch']], axis=1)
+    accuracy = note_accuracy(notes, estimated)
+    accuracy['key'] = key
+    accuracy['key_correct'] = accuracy['key'] == EXPECTED_KEY
+    return {'stages': stages, 'accuracy': accuracy}
+
+
+def compare(results, baseline, tolerance, f1_tolerance):
+    # [(duration, stage or 'accuracy', metric, baseline value, current value), ...]
+    regressions = []
+    for duration, result in results.items():
+        previous = baseline.get('results', {}).get(duration)
+        if previous is None:
+            continue
+        for stage, metrics in result['stages'].items():
+            before = previous['stages'].get(stage)
+            if before is None:
+                continue
+            for metric, min_delta in (('wall_s', MIN_SECONDS_DELTA), ('cpu_s', MIN_SECONDS_DELTA),
+                                      ('peak_rss_mb', MIN_RSS_DELTA_MB)):
+                if metrics[metric] > before[metric] * (1 + tolerance) and metrics[metric] - before[metric] > min_delta:
+                    regressions.append((duration, stage, metric, before[metric], metrics[metric]))
+        accuracy, before = result['accuracy'], previous['accuracy']
+        if accuracy['f1'] < before['f1'] - f1_tolerance:
+            regressions.append((duration, 'accuracy', 'f1', before['f1'], accuracy['f1']))
+        if before['key_correct'] and not accuracy['key_correct']:
+            regressions.append((duration, 'accuracy', 'key', before['key'], accuracy['key']))
+    return regressions
+
+
+def print_report(results, baseline, regressions):
+    flagged = {(duration, stage, metric) for duration, stage, metric, _, _ in regressions}
+    previous = baseline.get('results', {})
+    for duration, result in results.items():
+        print(f"\n{duration} s")
+        print(f"{'stage':<14} {'wall s':>8} {'cpu s':>8} {'peak MB':>8} {'base wall':>10}")
+        for stage, metrics in result['stages'].items():
+            before = previous.get(duration, {}).get('stages', {}).get(stage)
+            marks = ''.join('!' if (duration, stage, metric) in flagged else ' '
+                            for metric in ('wall_s', 'cpu_s', 'peak_rss_mb'))
+            print(f"{stage:<14} {metrics['wall_s']:>8.3f} {metrics['cpu_s']:>8.3f} {metrics['peak_rss_mb']:>8.0f} "
+                  f"{before['wall_s'] if before else float('nan'):>10.3f} {marks}")
+        total = sum(metrics['wall_s'] for metrics in result['stages'].values())
+        accuracy = result['accuracy']
+        print(f"{'total':<14} {total:>8.3f}")
+        print(f"notes {accuracy['notes_found']}/{accuracy['notes_expected']}  precision {accuracy['precision']:.3f}  "
+              f"recall {accuracy['recall']:.3f}  F1 {accuracy['f1']:.3f}  key {accuracy['key']}"
+              f"{'' if accuracy['key_correct'] else ' (expected ' + EXPECTED_KEY + ')'}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against the baseline:")
+        for duration, stage, metric, before, after in regressions:
+            if isinstance(before, float):
+                print(f"  {duration} s {stage} {metric}: {before:.3f} -> {after:.3f}")
+            else:
+                print(f"  {duration} s {stage} {metric}: {before} -> {after}")
+    elif previous:
+        print("\nNo regressions against the baseline.")
+    else:
+        print("\nNo baseline to compare with; run with --save-baseline to store one.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durations', type=float, nargs='+', default=[15, 90, 300])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--format', choices=['m4a', 'wav'], default='m4a')
+    parser.add_argument('--preprocess-mode', choices=PREPROCESS_MODES, default=DEFAULT_PREPROCESS_MODE)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown or RSS growth")
+    parser.add_argument('--f1-tolerance', type=float, default=0.02, help="Allowed absolute drop in note F1")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if not reset_peak_rss():
+        print("Peak RSS can't be reset on this platform; it is the process high-water mark", file=sys.stderr)
+
+    # Load and warm the model first so neither lands in the first run's Basic Pitch stage
+    recorder = StageRecorder()
+    with recorder.stage('load_model'):
+        get_engine().load()
+        get_engine().warmup()
+
+    results = {}
+    for seconds in args.durations:
+        print(f"Benchmarking {seconds:g} s...", file=sys.stderr)
+        results[f"{seconds:g}"] = benchmark(seconds, args.format, args.preprocess_mode, args.repeat)
+
+    report = {'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                       'cpus': os.cpu_count()},
+              'settings': {'format': args.format, 'preprocess_mode': args.preprocess_mode, 'repeat': args.repeat},
+              'setup': recorder.stages,
+              'results': results}
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != report['settings']:
+            print(f"Baseline settings {baseline.get('settings')} differ from this run's; "
+                  f"comparisons may not be meaningful", file=sys.stderr)
+        if baseline.get('host', {}).get('cpus') != report['host']['cpus']:
+            print("Baseline was recorded on a host with a different CPU count", file=sys.stderr)
+
+    regressions = compare(results, baseline, args.tolerance, args.f1_tolerance)
+    print(f"load_model: {recorder.stages['load_model']['wall_s']:.2f} s")
+    print_report(results, baseline, regressions)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Time repeated /process selections of one preview, per selection and per path.
+
+A synthetic 30 s sung melody is encoded like an iTunes preview and served
+from a local Range-capable HTTP server. A series of start/end selections is
+run through the job function:
+
+  selection    the old path: range fetch, decode the selection, HPSS, model,
+               notes, merge, key, render (caches off, so every change of
+               selection pays for all of it)
+  preview      run_transcription_job: the first selection takes the old path
+               and asks for a follow-up job that analyses the whole preview
+               (run here between selections, as an idle queue worker would,
+               and timed separately); later ones slice its cached notes and
+               only merge, detect the key and render
+
+Both paths are scored against the known notes of each selection (same pitch,
+onset within 50 ms; notes cut by the selection start count from its start),
+and the KB each downloaded is reported.
+
+    python benchmarks/selection_reuse.py --preprocess-mode hpss
+"""
+import os
+import sys
+import time
+import io
+import argparse
+import logging
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+os.environ['TRANSCRIPTION_CACHE_BACKEND'] = 'memory'
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from range_fetch import RangeHandler
+from run_benchmarks import synthetic_melody, synthesize, encode, note_accuracy
+from audio_io import fetch_audio, decode_audio_bytes, TARGET_SAMPLE_RATE
+from preprocessing import PREPROCESS_MODES, DEFAULT_PREPROCESS_MODE
+from note_table import as_transcription
+from vocal_parts_to_sheet_music import (preprocess_audio, notes_from_activations, create_sheet_music,
+                                        quantize_duration_extended)
+from inference_engine import get_engine
+import jobs
+
+SELECTIONS = ((0, 10), (2, 12), (5, 15), (10, 20), (15, 30), (1.5, 8.25))
+
+
+def old_selection(url, start, end, preprocess_mode):
+    # What run_transcription_job did before, without its caches
+    data = fetch_audio(url, end)
+    audio = decode_audio_bytes(data, start, end, format='m4a')
+    y, sr = preprocess_audio(None, True, audio=audio, preprocess_mode=preprocess_mode)
+    transcription = notes_from_activations(get_engine().run_model(y, sr))
+    create_sheet_music(transcription, None, "memory", quantize_duration_extended, '')
+    return transcription
+
+
+def selection_truth(notes, start, end):
+    return [(max(note_start, start) - start, min(note_end, end) - start, pitch)
+            for note_start, note_end, pitch in notes if note_end > start and note_start < end]
+
+
+def job_notes(result):
+    # The notes the job rendered, read back from its MIDI artifact
+    import pretty_midi
+    return pretty_midi.PrettyMIDI(io.BytesIO(result['artifacts']['midi']))
+
+
+def onsets(transcription):
+    return [(start, pitch) for start, _, pitch, _, _ in as_transcription(transcription).notes.tolist()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preprocess-mode', choices=PREPROCESS_MODES, default=DEFAULT_PREPROCESS_MODE)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['PREVIEW_CACHE_DIR'] = temp_dir
+        notes = synthetic_melody(30, seed=args.seed)
+        RangeHandler.payload = encode(synthesize(notes, 30, seed=args.seed), TARGET_SAMPLE_RATE, 'm4a')
+        server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/preview.m4a'
+        get_engine().warmup()
+
+        print(f"{'selection':>12} {'old s':>7} {'preview s':>10} {'old KB':>7} {'preview KB':>11} "
+              f"{'old F1':>7} {'preview F1':>11} {'follow-up s':>12}")
+        for start, end in SELECTIONS:
+            RangeHandler.bytes_sent = 0
+            started = time.perf_counter()
+            old = old_selection(url, start, end, args.preprocess_mode)
+            old_seconds = time.perf_counter() - started
+            old_kb = RangeHandler.bytes_sent / 1024
+
+            RangeHandler.bytes_sent = 0
+            started = time.perf_counter()
+            result = jobs.run_transcription_job('benchmark', url, start, end, args.preprocess_mode)
+            new_seconds = time.perf_counter() - started
+            new_kb = RangeHandler.bytes_sent / 1024
+            new = job_notes(result)
+
+            follow_up_seconds = 0.0
+            follow_up = result.pop('follow_up', None)
+            if follow_up is not None:
+                started = time.perf_counter()
+                follow_up[0]('benchmark-follow-up', *follow_up[1:])
+                follow_up_seconds = time.perf_counter() - started
+
+            truth = selection_truth(notes, start, end)
+            print(f"{f'{start:g}-{end:g}s':>12} {old_seconds:>7.2f} {new_seconds:>10.2f} {old_kb:>7.0f} {new_kb:>11.0f} "
+                  f"{note_accuracy(truth, onsets(old))['f1']:>7.2f} {note_accuracy(truth, onsets(new))['f1']:>11.2f} "
+                  f"{follow_up_seconds:>12.2f}")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
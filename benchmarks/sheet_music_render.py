@@ -0,0 +1,76 @@
+"""Compare the direct MusicXML writer with the music21 renderer on long transcriptions.
+
+Synthetic lead and harmony transcriptions of increasing length are rendered to
+an in-memory MusicXML string by create_sheet_music with each renderer. Time is
+measured without tracemalloc (its allocation hook slows music21's object-heavy
+path far more than the writer); peak Python heap is measured on a separate run.
+
+    python benchmarks/sheet_music_render.py --notes 200 1000 5000 --repeat 3
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from note_table import Transcription, NOTE_DTYPE
+from vocal_parts_to_sheet_music import create_sheet_music, quantize_duration_extended
+
+
+def synthetic_transcription(n_notes, seed=0):
+    # A monophonic line at about two notes a second, with gaps for the harmony's rests
+    rng = np.random.default_rng(seed)
+    notes = np.zeros(n_notes, dtype=NOTE_DTYPE)
+    durations = rng.choice([0.2, 0.4, 0.6, 1.0, 1.6], n_notes)
+    gaps = rng.choice([0.0, 0.0, 0.1, 0.5], n_notes)
+    notes['start'] = np.cumsum(gaps + np.r_[0, durations[:-1]])
+    notes['end'] = notes['start'] + durations
+    notes['pitch'] = 57 + rng.choice([0, 2, 3, 5, 7, 8, 10, 12, 1, 6], n_notes)
+    notes['velocity'] = 90
+    return Transcription(notes)
+
+
+def render(renderer, lead, harmony):
+    return create_sheet_music(lead, harmony, "memory", quantize_duration_extended, "bench",
+                              include_harmony=True, renderer=renderer)
+
+
+def measure(renderer, lead, harmony, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        musicxml = render(renderer, lead, harmony)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    render(renderer, lead, harmony)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return np.median(times), peak, len(musicxml)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, nargs='+', default=[200, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Key detection prints; keep the table readable
+    devnull = open(os.devnull, 'w')
+    print(f"{'notes':>6} {'renderer':<8} {'median s':>9} {'peak MB':>8} {'XML KB':>8}")
+    for n_notes in args.notes:
+        for renderer in ('music21', 'fast'):
+            lead, harmony = synthetic_transcription(n_notes), synthetic_transcription(n_notes, seed=1)
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                elapsed, peak, size = measure(renderer, lead, harmony, args.repeat)
+            finally:
+                sys.stdout = stdout
+            print(f"{n_notes:>6} {renderer:<8} {elapsed:>9.3f} {peak / 1e6:>8.1f} {size / 1024:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,29 @@
-import yt_dlp
 import time
 import re
 import os
+import sys
+import argparse
+import tempfile
+import threading
 import subprocess
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from audio_io import TARGET_SAMPLE_RATE
+
+# yt_dlp is imported where it is needed: local files and direct media URLs go straight to ffmpeg
+
+# ffmpeg reads these straight from a URL, seeking with Range requests, so only the section is fetched
+DIRECT_MEDIA_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.mp4', '.aac', '.webm', '.ogg', '.opus', '.flac')
+# yt-dlp protocols whose stream URL ffmpeg can open and seek itself
+FFMPEG_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
 
 def sanitize_filename(filename):
     return re.sub(r'[^\w\-_\.]', '', filename.replace(' ', '_'))
 
 def extract_audio(data_folder):
+    import yt_dlp
+
     video_url = input("Enter the YouTube URL: ")
     cut_audio = input("Do you want to cut the audio? (y/n): ").lower() == 'y'
     if cut_audio:
@@ -71,7 +87,144 @@ def extract_audio(data_folder):
     print(f"Audio extraction complete. Output saved as: {output_path}")
     print(f"Extraction took {time.time() - start_time:.2f} seconds")
 
+def parse_batch_file(path):
+    # One item per line: URL or local path, then optional start and duration in seconds.
+    # Blank lines and lines starting with # are skipped.
+    items = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) > 3:
+                raise ValueError(f"{path}:{line_number}: expected 'URL [start] [duration]'")
+            items.append({'url': fields[0],
+                          'start': float(fields[1]) if len(fields) > 1 else 0.0,
+                          'duration': float(fields[2]) if len(fields) > 2 else None})
+    return items
+
+def resolve_source(url):
+    # (ffmpeg input, ffmpeg input options, title); the input is None when only yt-dlp can fetch the stream
+    if os.path.exists(url):
+        return url, [], os.path.splitext(os.path.basename(url))[0]
+    path = urlparse(url).path
+    if path.lower().endswith(DIRECT_MEDIA_EXTENSIONS):
+        return url, [], os.path.splitext(os.path.basename(path))[0]
+
+    import yt_dlp
+    with yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'quiet': True, 'no_warnings': True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    title = info.get('title') or info['id']
+    if info.get('protocol') not in FFMPEG_PROTOCOLS:
+        return None, [], title
+    headers = ''.join(f"{name}: {value}\r\n" for name, value in (info.get('http_headers') or {}).items())
+    return info['url'], ['-headers', headers] if headers else [], title
+
+def download_section(url, start, duration, temp_dir):
+    # For streams ffmpeg can't open directly (e.g. DASH fragments): yt-dlp fetches just the section
+    import yt_dlp
+    from yt_dlp.utils import download_range_func
+
+    opts = {'format': 'bestaudio/best', 'quiet': True, 'no_warnings': True,
+            'outtmpl': {'default': os.path.join(temp_dir, 'source.%(ext)s')}}
+    if start or duration:
+        opts['download_ranges'] = download_range_func(None, [(start, start + duration if duration else float('inf'))])
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+    return info['requested_downloads'][0]['filepath']
+
+def transcode_to_wav(source, output_path, sample_rate=TARGET_SAMPLE_RATE, start=0.0, duration=None, input_options=()):
+    # Input seeking (-ss/-t before -i) makes ffmpeg read only the section; the output is mono float
+    # WAV at the model's rate, so loading it needs no resampling and there is no lossy round trip
+    command = ['ffmpeg', '-v', 'error', '-y', *input_options]
+    if start:
+        command += ['-ss', str(start)]
+    if duration:
+        command += ['-t', str(duration)]
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    command += ['-i', source, '-vn', '-ac', '1', '-ar', str(sample_rate), '-c:a', 'pcm_f32le', '-f', 'wav', temp_path]
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(e.stderr.strip() or f"ffmpeg exited with status {e.returncode}")
+    os.replace(temp_path, output_path)
+
+def extract_item(item, output_dir, sample_rate=TARGET_SAMPLE_RATE):
+    start_time = time.perf_counter()
+    timings = {}
+    start, duration = item['start'], item['duration']
+
+    source, input_options, title = resolve_source(item['url'])
+    timings['resolve'] = time.perf_counter() - start_time
+
+    section = f"{start:g}-{start + duration:g}s" if duration else f"{start:g}s-end"
+    output_path = os.path.join(output_dir, f"{sanitize_filename(title)}_{section}.wav")
+    if source is None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            step_start = time.perf_counter()
+            downloaded = download_section(item['url'], start, duration, temp_dir)
+            timings['download'] = time.perf_counter() - step_start
+            step_start = time.perf_counter()
+            # The download already starts at the section start
+            transcode_to_wav(downloaded, output_path, sample_rate)
+    else:
+        step_start = time.perf_counter()
+        transcode_to_wav(source, output_path, sample_rate, start, duration, input_options)
+    timings['transcode'] = time.perf_counter() - step_start
+    return dict(item, output=output_path, timings=timings, seconds=time.perf_counter() - start_time)
+
+def extract_batch(items, output_dir, jobs=4, sample_rate=TARGET_SAMPLE_RATE):
+    # Downloads and transcodes are network and ffmpeg bound, so threads are enough; jobs bounds how
+    # many run at once. Results come back in input order, with 'error' set for failed items.
+    os.makedirs(output_dir, exist_ok=True)
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {executor.submit(extract_item, item, output_dir, sample_rate): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+                print(f"[{i + 1}/{len(items)}] {results[i]['output']} ({results[i]['seconds']:.2f} seconds)")
+            except Exception as e:
+                results[i] = dict(items[i], error=str(e))
+                print(f"[{i + 1}/{len(items)}] Error extracting {items[i]['url']}: {e}")
+    return results
+
+def print_batch_report(results, elapsed):
+    print(f"\n{'#':>3} {'resolve':>8} {'download':>9} {'transcode':>10} {'total':>7}  output")
+    for i, result in enumerate(results, 1):
+        if 'error' in result:
+            print(f"{i:>3} {'':>8} {'':>9} {'':>10} {'':>7}  failed: {result['url']}")
+            continue
+        timings = result['timings']
+        download = f"{timings['download']:.2f}" if 'download' in timings else '-'
+        print(f"{i:>3} {timings['resolve']:>8.2f} {download:>9} {timings['transcode']:>10.2f} "
+              f"{result['seconds']:>7.2f}  {result['output']}")
+    failed = sum(1 for result in results if 'error' in result)
+    print(f"Extracted {len(results) - failed} of {len(results)} items in {elapsed:.2f} seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract audio from videos, interactively or from a batch file.")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="File of 'URL [start] [duration]' lines; extracts each section to WAV without prompts")
+    parser.add_argument('--jobs', type=int, default=4, help="Items extracted at once in batch mode")
+    parser.add_argument('--output-dir', default=os.path.join('data', 'extracted_audio'))
+    parser.add_argument('--sample-rate', type=int, default=TARGET_SAMPLE_RATE)
+    args = parser.parse_args()
+
+    if not args.batch:
+        extract_audio('data')
+        return
+
+    items = parse_batch_file(args.batch)
+    start_time = time.perf_counter()
+    results = extract_batch(items, args.output_dir, args.jobs, args.sample_rate)
+    print_batch_report(results, time.perf_counter() - start_time)
+    if any('error' in result for result in results):
+        sys.exit(1)
+
 # Example usage
 if __name__ == "__main__":
-    data_folder = 'data'
-    extract_audio(data_folder)
\ No newline at end of file
+    main()
@@ -0,0 +1,19 @@
+import os
+import threading
+
+from jobs import admission_limit
+
+# Every job a client follows over /status/<id>/events holds a thread until it finishes, and the
+# app allows one stream per admissible job. The headroom keeps threads free for everything
+# else, in particular the fast 429 when the queue is full.
+REQUEST_THREADS = int(os.environ.get('WEB_REQUEST_THREADS', 4))
+threads = admission_limit() + REQUEST_THREADS
+
+
+def post_fork(server, worker):
+    # With PRELOAD_BASIC_PITCH set, bring the job workers up with a resident, warmed model
+    # so the first request doesn't pay for model load and graph setup
+    from inference_engine import preload_enabled
+    if preload_enabled():
+        from jobs import job_queue
+        threading.Thread(target=job_queue.start, daemon=True).start()
@@ -0,0 +1,63 @@
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+# Packages that make up the inference stack; the web process should import none of them at startup
+HEAVY_PACKAGES = ('tensorflow', 'basic_pitch', 'librosa', 'numba', 'llvmlite', 'scipy', 'music21',
+                  'pretty_midi', 'soundfile', 'sklearn', 'crepe', 'onnxruntime', 'coremltools')
+
+
+def import_costs(module):
+    # Import `module` in a fresh interpreter with -X importtime and return
+    # [(module_name, self_seconds, cumulative_seconds, depth), ...] in import order
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    costs = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        costs.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+    return costs
+
+
+def package_costs(costs):
+    # Self time summed per top-level package, so e.g. every scipy submodule counts towards scipy
+    totals = defaultdict(float)
+    for name, self_seconds, _, _ in costs:
+        totals[name.split('.')[0]] += self_seconds
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def report(module, top=15, file=sys.stdout):
+    costs = import_costs(module)
+    total = next(cumulative for name, _, cumulative, depth in costs if name == module and depth == 0)
+    packages = package_costs(costs)
+    heavy = [name for name, _ in packages if name in HEAVY_PACKAGES]
+
+    print(f"import {module}: {total:.3f} s, {len(costs)} modules", file=file)
+    print(f"{'package':<28} {'seconds':>8} {'share':>6}", file=file)
+    for name, seconds in packages[:top]:
+        flag = '  <- inference stack' if name in HEAVY_PACKAGES else ''
+        print(f"{name:<28} {seconds:>8.3f} {seconds / total:>6.0%}{flag}", file=file)
+    print(f"inference stack loaded: {', '.join(heavy) if heavy else 'none'}", file=file)
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Break down the import cost of a module by package.")
+    parser.add_argument('modules', nargs='*', default=['app', 'jobs', 'vocal_parts_to_sheet_music'])
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        report(module, args.top)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+
+# librosa, scipy and the models are imported where they are used: the web process imports this
+# module only for ENGINES
+
+logger = logging.getLogger(__name__)
+
+# Pitch engines: Basic Pitch (polyphonic note activations) and CREPE (one pitch per frame, a
+# lighter option for monophonic lead vocals)
+ENGINES = ('basic_pitch', 'crepe')
+DEFAULT_ENGINE = 'basic_pitch'
+
+# Basic Pitch windowing, mirroring basic_pitch.inference.run_inference
+AUDIO_SAMPLE_RATE = 22050
+FFT_HOP = 256
+ANNOTATIONS_FPS = AUDIO_SAMPLE_RATE // FFT_HOP
+AUDIO_N_SAMPLES = AUDIO_SAMPLE_RATE * 2 - FFT_HOP
+N_OVERLAPPING_FRAMES = 30
+OVERLAP_LEN = N_OVERLAPPING_FRAMES * FFT_HOP
+HOP_SIZE = AUDIO_N_SAMPLES - OVERLAP_LEN
+
+
+def window_audio(y):
+    # Pad and cut audio into overlapping model windows of shape (n_windows, AUDIO_N_SAMPLES, 1)
+    y = np.concatenate([np.zeros(OVERLAP_LEN // 2, dtype=np.float32), y.astype(np.float32)])
+    n_windows = max(1, int(np.ceil(len(y) / HOP_SIZE)))
+    padded_length = (n_windows - 1) * HOP_SIZE + AUDIO_N_SAMPLES
+    y = np.pad(y, (0, max(0, padded_length - len(y))))
+    windows = np.lib.stride_tricks.sliding_window_view(y, AUDIO_N_SAMPLES)[::HOP_SIZE][:n_windows]
+    return np.ascontiguousarray(windows)[..., np.newaxis]
+
+
+def unwrap_output(output, audio_original_length):
+    # Drop the overlapping frames and stitch windows back into one (n_frames, n_bins) matrix
+    n_olap = N_OVERLAPPING_FRAMES // 2
+    output = output[:, n_olap:-n_olap, :]
+    n_output_frames = int(np.floor(audio_original_length * (ANNOTATIONS_FPS / AUDIO_SAMPLE_RATE)))
+    return output.reshape(-1, output.shape[2])[:n_output_frames, :]
+
+
+class BasicPitchEngine:
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+        self.model = None
+        self.load_time = None
+        self.warmup_time = None
+        self.last_inference_time = None
+        self.total_inference_time = 0.0
+        self.inference_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self):
+        # Part of the cache keys
+        return str(self.model_path or 'icassp_2022')
+
+    def load(self):
+        with self._lock:
+            if self.model is None:
+                from basic_pitch.inference import Model
+                from basic_pitch import ICASSP_2022_MODEL_PATH
+
+                start_time = time.time()
+                self.model = Model(self.model_path or ICASSP_2022_MODEL_PATH)
+                self.load_time = time.time() - start_time
+                logger.info("Basic Pitch model loaded in %.2f seconds", self.load_time)
+        return self.model
+
+    def warmup(self, duration=2.0):
+        # The first forward pass pays for graph tracing; do it before real traffic arrives
+        self.load()
+        start_time = time.time()
+        self.model.predict(window_audio(np.zeros(int(duration * AUDIO_SAMPLE_RATE), dtype=np.float32)))
+        self.warmup_time = time.time() - start_time
+        logger.info("Basic Pitch warmup completed in %.2f seconds", self.warmup_time)
+        return self.stats()
+
+    def run_model(self, y, sr):
+        # Returns the raw note/onset/contour activations for an in-memory mono signal
+        self.load()
+        if sr != AUDIO_SAMPLE_RATE:
+            import librosa
+            y = librosa.resample(y, orig_sr=sr, target_sr=AUDIO_SAMPLE_RATE)
+
+        start_time = time.time()
+        output = self.model.predict(window_audio(y))
+        model_output = {k: unwrap_output(v, len(y)) for k, v in output.items()}
+        self._record_inference(time.time() - start_time)
+        return model_output
+
+    def _record_inference(self, elapsed):
+        with self._lock:
+            self.last_inference_time = elapsed
+            self.total_inference_time += elapsed
+            self.inference_count += 1
+        logger.info("Basic Pitch inference completed in %.2f seconds", elapsed)
+
+    def predict(self, y, sr, onset_threshold=0.5, frame_threshold=0.3, minimum_note_length=127.70,
+                minimum_frequency=None, maximum_frequency=None, multiple_pitch_bends=False,
+                melodia_trick=True, midi_tempo=120):
+        # Same return value as basic_pitch.inference.predict: (model_output, midi_data, note_events)
+        return self.notes_from_output(self.run_model(y, sr), onset_threshold, frame_threshold,
+                                      minimum_note_length, minimum_frequency, maximum_frequency,
+                                      multiple_pitch_bends, melodia_trick, midi_tempo)
+
+    def notes_from_output(self, model_output, onset_threshold=0.5, frame_threshold=0.3,
+                          minimum_note_length=127.70, minimum_frequency=None, maximum_frequency=None,
+                          multiple_pitch_bends=False, melodia_trick=True, midi_tempo=120):
+        from basic_pitch import note_creation
+
+        # minimum_note_length is in milliseconds, as in basic_pitch.inference.predict
+        min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+        midi_data, note_events = note_creation.model_output_to_notes(
+            model_output,
+            onset_thresh=onset_threshold,
+            frame_thresh=frame_threshold,
+            min_note_len=min_note_len,
+            min_freq=minimum_frequency,
+            max_freq=maximum_frequency,
+            multiple_pitch_bends=multiple_pitch_bends,
+            melodia_trick=melodia_trick,
+            midi_tempo=midi_tempo,
+        )
+        return model_output, midi_data, note_events
+
+    def stats(self):
+        return {
+            'model_loaded': self.model is not None,
+            'load_time': self.load_time,
+            'warmup_time': self.warmup_time,
+            'last_inference_time': self.last_inference_time,
+            'mean_inference_time': self.total_inference_time / self.inference_count if self.inference_count else None,
+            'inference_count': self.inference_count,
+        }
+
+
+def resample_poly(y, sr, target_sr):
+    # Polyphase resampling: a short FIR filter per output sample instead of an FFT over the whole signal
+    from math import gcd
+    from scipy import signal
+    if sr == target_sr:
+        return y.astype(np.float32)
+    factor = gcd(int(sr), int(target_sr))
+    return signal.resample_poly(y, int(target_sr) // factor, int(sr) // factor).astype(np.float32)
+
+
+def segment_pitch_track(frequency, confidence, step_size, confidence_threshold=0.5, minimum_note_length=58,
+                        minimum_frequency=None, maximum_frequency=None):
+    # Per-frame pitch -> NOTE_DTYPE rows. Frames below the confidence threshold or outside the
+    # frequency range are unvoiced (pitch 0); every run of frames with the same rounded MIDI pitch
+    # is one note, found with np.diff instead of a loop over frames.
+    from note_table import NOTE_DTYPE
+
+    voiced = (confidence >= confidence_threshold) & (frequency > 0)
+    if minimum_frequency:
+        voiced &= frequency >= minimum_frequency
+    if maximum_frequency:
+        voiced &= frequency <= maximum_frequency
+    midi = np.zeros(len(frequency), dtype=np.int16)
+    midi[voiced] = np.round(69 + 12 * np.log2(frequency[voiced] / 440.0))
+    if not len(midi):
+        return np.empty(0, dtype=NOTE_DTYPE)
+
+    boundaries = np.flatnonzero(np.diff(midi)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(midi)]))
+    lengths = ends - starts
+    # minimum_note_length is in milliseconds, as for Basic Pitch
+    keep = (midi[starts] > 0) & (lengths >= max(1, int(np.ceil(minimum_note_length / step_size))))
+
+    notes = np.empty(int(keep.sum()), dtype=NOTE_DTYPE)
+    notes['start'] = starts[keep] * (step_size / 1000)
+    notes['end'] = ends[keep] * (step_size / 1000)
+    notes['pitch'] = midi[starts[keep]]
+    # Mean confidence over the note stands in for Basic Pitch's amplitude
+    notes['velocity'] = np.round(127 * np.add.reduceat(confidence, starts)[keep] / lengths[keep])
+    notes['track'] = 0
+    return notes
+
+
+class CrepeEngine:
+    # CREPE pitch tracking. Capacity trades accuracy for speed ('tiny' is roughly 1/30th of 'full'
+    # in parameters) and step_size sets the frame hop in milliseconds.
+    MODEL_CAPACITIES = ('tiny', 'small', 'medium', 'large', 'full')
+    SAMPLE_RATE = 16000
+
+    def __init__(self, model_capacity='full', step_size=10, viterbi=True):
+        if model_capacity not in self.MODEL_CAPACITIES:
+            raise ValueError(f"model_capacity must be one of {', '.join(self.MODEL_CAPACITIES)}")
+        self.model_capacity = model_capacity
+        self.step_size = int(step_size)
+        self.viterbi = viterbi
+        self.model = None
+        self.load_time = None
+        self.warmup_time = None
+        self.last_inference_time = None
+        self.total_inference_time = 0.0
+        self.inference_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self):
+        return f"crepe-{self.model_capacity}-{self.step_size}ms{'-viterbi' if self.viterbi else ''}"
+
+    def load(self):
+        with self._lock:
+            if self.model is None:
+                from crepe.core import build_and_load_model
+
+                start_time = time.time()
+                # crepe keeps the built model per capacity, so predict() reuses this one
+                self.model = build_and_load_model(self.model_capacity)
+                self.load_time = time.time() - start_time
+                logger.info("CREPE %s model loaded in %.2f seconds", self.model_capacity, self.load_time)
+        return self.model
+
+    def warmup(self, duration=2.0):
+        start_time = time.time()
+        self.run_model(np.zeros(int(duration * self.SAMPLE_RATE), dtype=np.float32), self.SAMPLE_RATE)
+        self.warmup_time = time.time() - start_time
+        logger.info("CREPE warmup completed in %.2f seconds", self.warmup_time)
+        return self.stats()
+
+    def run_model(self, y, sr):
+        # Returns the pitch track for an in-memory mono signal: Hz and confidence per frame, plus
+        # the hop, so stored tracks can be segmented without knowing the engine settings
+        import crepe
+
+        self.load()
+        y = resample_poly(y, sr, self.SAMPLE_RATE)
+        start_time = time.time()
+        _, frequency, confidence, _ = crepe.predict(y, self.SAMPLE_RATE, model_capacity=self.model_capacity,
+                                                    viterbi=self.viterbi, step_size=self.step_size, verbose=0)
+        self._record_inference(time.time() - start_time)
+        return {'frequency': frequency.astype(np.float32),
+                'confidence': confidence.astype(np.float32),
+                'step_size': np.array([self.step_size], dtype=np.float32)}
+
+    def _record_inference(self, elapsed):
+        with self._lock:
+            self.last_inference_time = elapsed
+            self.total_inference_time += elapsed
+            self.inference_count += 1
+        logger.info("CREPE inference completed in %.2f seconds", elapsed)
+
+    def predict(self, y, sr, **kwargs):
+        return self.notes_from_output(self.run_model(y, sr), **kwargs)
+
+    def notes_from_output(self, pitch_track, confidence_threshold=0.5, minimum_note_length=58,
+                          minimum_frequency=None, maximum_frequency=None):
+        # (pitch_track, Transcription, None), shaped like BasicPitchEngine.notes_from_output
+        from note_table import Transcription
+
+        notes = segment_pitch_track(pitch_track['frequency'], pitch_track['confidence'],
+                                    float(pitch_track['step_size'][0]), confidence_threshold,
+                                    minimum_note_length, minimum_frequency, maximum_frequency)
+        return pitch_track, Transcription(notes), None
+
+    def stats(self):
+        return {
+            'model_loaded': self.model is not None,
+            'load_time': self.load_time,
+            'warmup_time': self.warmup_time,
+            'last_inference_time': self.last_inference_time,
+            'mean_inference_time': self.total_inference_time / self.inference_count if self.inference_count else None,
+            'inference_count': self.inference_count,
+        }
+
+
+_engines = {}
+_engine_pid = None
+
+
+def _make_engine(name):
+    if name == 'crepe':
+        return CrepeEngine(os.environ.get('CREPE_MODEL_CAPACITY', 'full'),
+                           step_size=int(os.environ.get('CREPE_STEP_SIZE_MS', 10)),
+                           viterbi=os.environ.get('CREPE_VITERBI', '1').lower() in ('1', 'true', 'yes'))
+    return BasicPitchEngine(os.environ.get('BASIC_PITCH_MODEL_PATH'))
+
+
+def get_engine(name=DEFAULT_ENGINE):
+    # One engine of each kind per process; a forked child gets its own rather than sharing the parent's session
+    global _engines, _engine_pid
+    if _engine_pid != os.getpid():
+        _engines = {}
+        _engine_pid = os.getpid()
+    if name not in _engines:
+        _engines[name] = _make_engine(name)
+    return _engines[name]
+
+
+def preload_enabled():
+    return os.environ.get('PRELOAD_BASIC_PITCH', '').lower() in ('1', 'true', 'yes')
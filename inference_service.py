@@ -0,0 +1,130 @@
+import os
+import stat
+import logging
+import argparse
+import threading
+from multiprocessing.managers import BaseManager
+
+from telemetry import configure_logging
+
+# Inference-service mode: one long-lived process owns the job queue and its pool of
+# model-holding workers, and serves it over a local Unix socket. Web processes started with
+# INFERENCE_SERVICE_SOCKET set talk to it through RemoteJobQueue instead of forking their own
+# workers, so web concurrency (gunicorn --workers/--threads) and model memory
+# (inference_service.py --workers) are sized independently, with no external broker.
+
+DEFAULT_SOCKET = '/tmp/vocaltranscription-inference.sock'
+JOB_QUEUE_METHODS = ('submit', 'get', 'artifact', 'wait_for_update', 'active_count', 'stats', 'metrics')
+# Safe to send again after a dropped connection; a resent submit could queue the job twice
+IDEMPOTENT_METHODS = ('get', 'artifact', 'wait_for_update', 'active_count', 'stats', 'metrics')
+
+logger = logging.getLogger(__name__)
+
+
+def _authkey():
+    # No built-in default: a key shipped in the source would let anyone who can reach the socket in
+    authkey = os.environ.get('INFERENCE_SERVICE_AUTHKEY')
+    if not authkey:
+        raise RuntimeError("INFERENCE_SERVICE_AUTHKEY must be set for the inference service and its web processes")
+    return authkey.encode()
+
+
+class InferenceManager(BaseManager):
+    pass
+
+
+def serve(address, workers, queue_depth):
+    from jobs import JobQueue
+
+    queue = JobQueue(max_workers=workers, max_queue_depth=queue_depth)
+    # Spawn the workers before accepting connections; with PRELOAD_BASIC_PITCH they also warm the model
+    queue.start()
+
+    InferenceManager.register('job_queue', callable=lambda: queue, exposed=JOB_QUEUE_METHODS)
+    if os.path.exists(address):
+        os.unlink(address)
+    server = InferenceManager(address=address, authkey=_authkey()).get_server()
+    # Only the owning user may connect, on top of the authkey handshake
+    os.chmod(address, stat.S_IRUSR | stat.S_IWUSR)
+    logger.info("Inference service listening on %s with %d workers (queue depth %d)", address, workers, queue_depth)
+    server.serve_forever()
+
+
+class RemoteJobQueue:
+    # Same interface as jobs.JobQueue, backed by the inference service. Job state lives in the
+    # service, so every web process (and every thread in it) sees the same jobs.
+    def __init__(self, address=DEFAULT_SOCKET):
+        self.address = address
+        # Checked here so a missing key fails at startup rather than on the first request
+        self._authkey = _authkey()
+        self._proxy = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _queue(self):
+        with self._lock:
+            # Connect lazily, and again after a fork: a proxy must not be shared across processes
+            if self._proxy is None or self._pid != os.getpid():
+                InferenceManager.register('job_queue')
+                manager = InferenceManager(address=self.address, authkey=self._authkey)
+                manager.connect()
+                self._proxy = manager.job_queue()
+                self._pid = os.getpid()
+            return self._proxy
+
+    def _call(self, method, *args):
+        from jobs import ServiceUnavailableError
+
+        for attempt in range(2):
+            sent = False
+            try:
+                queue = self._queue()
+                sent = True
+                return getattr(queue, method)(*args)
+            except (ConnectionError, EOFError, FileNotFoundError) as e:
+                # The service may have restarted; reconnect once before giving up. A call that may
+                # already have reached the service is only resent when doing it twice is harmless.
+                with self._lock:
+                    self._proxy = None
+                if attempt or (sent and method not in IDEMPOTENT_METHODS):
+                    raise ServiceUnavailableError(f"Inference service at {self.address} is unavailable: {e}")
+
+    def start(self):
+        # The service spawns and warms its own workers
+        pass
+
+    def submit(self, fn, *args):
+        return self._call('submit', fn, *args)
+
+    def get(self, job_id):
+        return self._call('get', job_id)
+
+    def artifact(self, job_id, name):
+        return self._call('artifact', job_id, name)
+
+    def wait_for_update(self, job_id, version, timeout=15):
+        return self._call('wait_for_update', job_id, version, timeout)
+
+    def active_count(self):
+        return self._call('active_count')
+
+    def stats(self):
+        return self._call('stats')
+
+    def metrics(self):
+        return self._call('metrics')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the transcription workers behind a local socket.")
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SERVICE_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('JOB_WORKERS', 2)))
+    parser.add_argument('--queue-depth', type=int, default=int(os.environ.get('JOB_QUEUE_DEPTH', 8)))
+    args = parser.parse_args()
+
+    configure_logging()
+    serve(args.socket, args.workers, args.queue_depth)
+
+
+if __name__ == "__main__":
+    main()
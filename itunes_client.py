@@ -0,0 +1,166 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from telemetry import span, count
+
+# Song search against the iTunes Search API for /search. Searches fire on every keystroke, so
+# results are cached per normalized query for a while, identical searches already on their way
+# upstream are shared rather than repeated, and the top result's preview audio is fetched in the
+# background so the /process call that usually follows finds it in the preview cache.
+
+ITUNES_SEARCH_URL = 'https://itunes.apple.com/search'
+SEARCH_TIMEOUT = (3, 10)  # (connect, read) seconds
+# The Search API's own ceiling
+MAX_LIMIT = 200
+
+logger = logging.getLogger(__name__)
+
+
+class SearchError(Exception):
+    pass
+
+
+def normalize_query(query):
+    # 'Billie  Jean ' and 'billie jean' are the same search
+    return ' '.join(query.casefold().split())
+
+
+def parse_track(track):
+    return {'title': track.get('trackName'),
+            'artist': track.get('artistName'),
+            'album': track.get('collectionName'),
+            'url': track.get('previewUrl')}
+
+
+class SearchClient:
+    def __init__(self, base_url=ITUNES_SEARCH_URL, ttl=600, max_entries=1024, timeout=SEARCH_TIMEOUT,
+                 prefetch=True, prefetch_workers=2):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # (query, limit) -> (expires_at, results), least recently used first
+        self._cache = OrderedDict()
+        # (query, limit) -> Future for the upstream call in progress
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._prefetcher = ThreadPoolExecutor(max_workers=prefetch_workers) if prefetch else None
+        self._prefetching = set()
+
+    def search(self, query, limit=1):
+        key = (normalize_query(query), max(1, min(int(limit), MAX_LIMIT)))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                count('cache_requests_total', cache='search', result='hit')
+                return entry[1]
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                leader = True
+                self.misses += 1
+                count('cache_requests_total', cache='search', result='miss')
+            else:
+                leader = False
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            results = self._fetch(*key)
+        except Exception as e:
+            # Failures aren't cached; everyone waiting on this call gets the same error
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, results)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            del self._in_flight[key]
+        future.set_result(results)
+        return results
+
+    def _fetch(self, query, limit):
+        with span('itunes_search'):
+            try:
+                response = self.session.get(self.base_url, params={'term': query, 'entity': 'song', 'limit': limit},
+                                            timeout=self.timeout)
+            except requests.RequestException as e:
+                raise SearchError(f"iTunes search failed: {e}") from e
+        if response.status_code != 200:
+            raise SearchError(f"iTunes search failed. Status code: {response.status_code}")
+        try:
+            tracks = response.json().get('results', [])
+        except (ValueError, AttributeError) as e:
+            raise SearchError(f"iTunes search returned an unexpected response: {e}") from e
+        return [parse_track(track) for track in tracks]
+
+    def prefetch_preview(self, url):
+        # Fire and forget; skipped when the preview is cached or already being fetched
+        from transcription_cache import get_preview_cache
+
+        if self._prefetcher is None or not url:
+            return
+        with self._lock:
+            if url in self._prefetching:
+                return
+            self._prefetching.add(url)
+        if url in get_preview_cache():
+            with self._lock:
+                self._prefetching.discard(url)
+            return
+        self._prefetcher.submit(self._prefetch, url)
+
+    def _prefetch(self, url):
+        from audio_io import fetch_audio
+        from transcription_cache import get_preview_cache
+
+        try:
+            start_time = time.time()
+            # The whole preview: the selection isn't known yet
+            get_preview_cache().set(url, fetch_audio(url))
+            logger.info("Prefetched preview %s in %.2f seconds", url, time.time() - start_time)
+        except Exception as e:
+            logger.warning("Preview prefetch failed for %s: %s", url, e)
+        finally:
+            with self._lock:
+                self._prefetching.discard(url)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'cached_queries': len(self._cache), 'prefetching': len(self._prefetching)}
+
+
+_client = None
+
+
+def get_search_client():
+    global _client
+    if _client is None:
+        _client = SearchClient(os.environ.get('ITUNES_SEARCH_URL', ITUNES_SEARCH_URL),
+                               ttl=float(os.environ.get('ITUNES_CACHE_TTL', 600)),
+                               max_entries=int(os.environ.get('ITUNES_CACHE_MAX_ENTRIES', 1024)),
+                               prefetch=os.environ.get('PREFETCH_PREVIEWS', '1').lower() in ('1', 'true', 'yes'))
+    return _client
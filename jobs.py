@@ -0,0 +1,418 @@
+import os
+import io
+import gzip
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import METRICS, span, traced, timings, configure_logging
+
+
+# Job states reported by the status endpoint
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+PROCESSING_MESSAGE = "Processing audio. This may take 30-60 seconds. Please wait..."
+
+# Files a finished job produces, served separately from its status: name -> (mimetype, stored gzipped).
+# MusicXML is verbose text and shrinks by an order of magnitude; MIDI is already compact.
+ARTIFACT_TYPES = {
+    'musicxml': ('application/vnd.recordare.musicxml+xml', True),
+    'midi': ('audio/midi', False),
+}
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by _init_worker so jobs can report their current stage
+_progress_queue = None
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class ServiceUnavailableError(Exception):
+    pass
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    # Spawned workers start with logging unconfigured
+    configure_logging()
+
+    from inference_engine import get_engine, preload_enabled
+    if preload_enabled():
+        # Pay for the pipeline imports and the model here rather than in the first job
+        start_time = time.time()
+        import vocal_parts_to_sheet_music  # noqa: F401
+        logger.info("Worker %d imported the transcription pipeline in %.2f seconds", os.getpid(), time.time() - start_time)
+        get_engine().warmup()
+
+
+def _noop():
+    return os.getpid()
+
+
+def report_stage(job_id, stage):
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, stage))
+
+
+def _run_job(fn, job_id, *args):
+    # Runs in the worker; the job's spans and counters go back with its result (or its exception)
+    with traced(job_id) as trace:
+        try:
+            result = fn(job_id, *args)
+        except Exception as e:
+            e.trace = trace.to_dict()
+            raise
+    return result, trace.to_dict()
+
+
+def _render_result(lead_midi, analysis_id, engine='basic_pitch', selection=None):
+    from vocal_parts_to_sheet_music import create_sheet_music, quantize_duration_extended
+    from inference_engine import get_engine
+    from key_analysis import analyze_key
+
+    musicxml = create_sheet_music(lead_midi, None, "memory", quantize_duration_extended, "processed", input_filename="processed.xml")
+
+    # Generate MIDI file
+    with span('midi_write'):
+        midi_buffer = io.BytesIO()
+        lead_midi.write(midi_buffer)
+
+    # Compressed once here rather than on every download; mtime=0 keeps the bytes reproducible
+    with span('compress'):
+        musicxml_gz = gzip.compress(musicxml.encode('utf-8'), compresslevel=6, mtime=0)
+
+    return {
+        # Kept by the job queue and served from their own URLs, not sent in the status JSON
+        'artifacts': {'musicxml': musicxml_gz, 'midi': midi_buffer.getvalue()},
+        'analysis_id': analysis_id,
+        # The part of the analysed audio this result covers; retuning sends it back
+        'selection': selection,
+        # Already computed for the key signature; memoized on the transcription
+        'key_candidates': [candidate.to_dict() for candidate in analyze_key(lead_midi)[:3]],
+        'processing_message': PROCESSING_MESSAGE,
+        'engine': get_engine(engine).stats()
+    }
+
+
+def run_transcription_job(job_id, audio_url, start_time, end_time, preprocess_mode='hpss', engine='basic_pitch'):
+    from vocal_parts_to_sheet_music import load_preview_analysis, analyze_preview, transcribe_selection, transcribe_audio
+    from audio_io import fetch_audio, decode_audio_bytes
+    from transcription_cache import get_preview_cache
+
+    selection = {'start_time': start_time, 'end_time': end_time}
+    # Once a track's whole preview has been analysed, every selection of it is a slice of the
+    # cached notes, with no download, decode, preprocessing or model run
+    analysis = load_preview_analysis(audio_url, preprocess_mode, engine)
+    if analysis is not None:
+        report_stage(job_id, 'transcribe')
+        lead_midi = transcribe_selection(analysis, start_time, end_time)
+        report_stage(job_id, 'render')
+        return _render_result(lead_midi, analysis['analysis_id'], engine, selection=selection)
+
+    # A preview prefetched after the search is already paid for, so it is analysed whole right away
+    report_stage(job_id, 'download')
+    with span('download'):
+        data = get_preview_cache().get(audio_url)
+        whole_preview = data is not None
+        if not whole_preview:
+            data = fetch_audio(audio_url, end_time)
+
+    report_stage(job_id, 'decode')
+    with span('decode'):
+        if whole_preview:
+            audio = decode_audio_bytes(data, format="m4a")
+        else:
+            # The selection is sliced by ffmpeg while decoding, so there is no separate slice stage
+            audio = decode_audio_bytes(data, start_time, end_time, format="m4a")
+
+    report_stage(job_id, 'transcribe')
+    if whole_preview:
+        analysis = analyze_preview(audio_url, audio, preprocess_mode, engine)
+        analysis_id = analysis['analysis_id']
+        lead_midi = transcribe_selection(analysis, start_time, end_time)
+    else:
+        analysis_id, lead_midi = transcribe_audio(audio, preprocess_mode, engine)
+        # The activations cover just the selection, so a retune needs no selection of its own
+        selection = None
+
+    report_stage(job_id, 'render')
+    result = _render_result(lead_midi, analysis_id, engine, selection=selection)
+    if not whole_preview:
+        # Only the selection was fetched; the whole preview is analysed after this result is out,
+        # so later selections of the track are slices
+        result['follow_up'] = (run_preview_analysis_job, audio_url, preprocess_mode, engine)
+    return result
+
+
+def run_preview_analysis_job(job_id, audio_url, preprocess_mode='hpss', engine='basic_pitch'):
+    from vocal_parts_to_sheet_music import load_preview_analysis, analyze_preview
+    from audio_io import fetch_audio, decode_audio_bytes
+
+    analysis = load_preview_analysis(audio_url, preprocess_mode, engine)
+    if analysis is None:
+        report_stage(job_id, 'download')
+        with span('download'):
+            data = fetch_audio(audio_url)
+        report_stage(job_id, 'decode')
+        with span('decode'):
+            audio = decode_audio_bytes(data, format="m4a")
+        report_stage(job_id, 'transcribe')
+        analysis = analyze_preview(audio_url, audio, preprocess_mode, engine)
+    return {'analysis_id': analysis['analysis_id']}
+
+
+def run_retune_job(job_id, analysis_id, config):
+    from vocal_parts_to_sheet_music import retune_transcription
+
+    report_stage(job_id, 'transcribe')
+    retuned = retune_transcription(analysis_id, **config)
+    if retuned is None:
+        raise RuntimeError('This transcription is no longer cached. Please process the audio again.')
+    lead_midi, engine = retuned
+
+    report_stage(job_id, 'render')
+    selection = None
+    if 'start_time' in config or 'end_time' in config:
+        selection = {'start_time': config.get('start_time'), 'end_time': config.get('end_time')}
+    return _render_result(lead_midi, analysis_id, engine, selection=selection)
+
+
+class Job:
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.state = QUEUED
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # {stage: milliseconds} from the worker's spans, once the job has finished
+        self.timings = None
+        # {name: bytes} split off the result; see ARTIFACT_TYPES
+        self.artifacts = {}
+        # Bumped on every change so streaming clients know when to send an update
+        self.version = 0
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'state': self.state,
+            'stage': self.stage,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.state == DONE:
+            data['result'] = self.result
+        elif self.state == ERROR:
+            data['error'] = self.error
+        if self.timings is not None:
+            data['timings'] = self.timings
+        return data
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_queue_depth=8, job_ttl=600):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.job_ttl = job_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._executor = None
+        self._progress_queue = None
+
+    def _ensure_executor(self):
+        # Created on first submit so importing the app never forks worker processes
+        if self._executor is None:
+            # spawn rather than fork: the web process is multi-threaded
+            ctx = multiprocessing.get_context('spawn')
+            self._progress_queue = ctx.Queue()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx,
+                                                 initializer=_init_worker, initargs=(self._progress_queue,))
+            threading.Thread(target=self._drain_progress, args=(self._progress_queue,), daemon=True).start()
+
+    def _retire_executor(self, executor):
+        # Called with the lock held once a pool is broken. Only the current pool is replaced: the
+        # other jobs of the same dead pool fail after a fresh one may already be running.
+        if executor is not self._executor:
+            return
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Stops its progress thread, which would otherwise wait on the old queue forever
+        self._progress_queue.put(None)
+        self._executor = None
+        self._progress_queue = None
+
+    def start(self):
+        # Spawn every worker up front (their initializer warms the model when preloading is on)
+        with self._lock:
+            self._ensure_executor()
+        for future in [self._executor.submit(_noop) for _ in range(self.max_workers)]:
+            future.result()
+
+    def _drain_progress(self, progress_queue):
+        while True:
+            update = progress_queue.get()
+            if update is None:
+                progress_queue.close()
+                return
+            job_id, stage = update
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.state in (DONE, ERROR):
+                    continue
+                if job.state == QUEUED:
+                    job.state = RUNNING
+                    job.started_at = time.time()
+                    METRICS.observe('job_queue_wait_seconds', job.started_at - job.created_at)
+                job.stage = stage
+                self._touch(job)
+
+    def _touch(self, job):
+        job.version += 1
+        self._changed.notify_all()
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state in (QUEUED, RUNNING))
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job.state in (QUEUED, RUNNING))
+            # Admission control: everything beyond the running jobs waits in the queue
+            if active >= self.max_workers + self.max_queue_depth:
+                raise QueueFullError(f"{active} jobs already queued or running")
+
+            self._ensure_executor()
+            executor = self._executor
+            job = Job(uuid.uuid4().hex, args)
+            self._jobs[job.id] = job
+
+        future = executor.submit(_run_job, fn, job.id, *args)
+        future.add_done_callback(lambda f: self._finish(job.id, f, executor))
+        return job
+
+    def _finish(self, job_id, future, executor):
+        follow_up = None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            trace = None
+            try:
+                job.result, trace = future.result()
+                follow_up = job.result.pop('follow_up', None)
+                job.artifacts = job.result.pop('artifacts', {})
+                job.result['artifacts'] = {name: len(data) for name, data in job.artifacts.items()}
+                job.state = DONE
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool for the next job
+                logger.error("Job %s failed: worker process died", job_id)
+                job.error = 'Worker process died while processing audio'
+                job.state = ERROR
+                self._retire_executor(executor)
+            except Exception as e:
+                logger.error("Job %s failed: %s", job_id, e, exc_info=e)
+                trace = getattr(e, 'trace', None)
+                job.error = str(e)
+                job.state = ERROR
+            job.stage = None
+            job.finished_at = time.time()
+            if trace is not None:
+                job.timings = timings(trace['spans'])
+                METRICS.merge(trace)
+            METRICS.inc('jobs_total', state=job.state)
+            METRICS.observe('job_seconds', job.finished_at - job.created_at)
+            self._touch(job)
+        if follow_up is not None:
+            self._submit_follow_up(*follow_up)
+
+    def _submit_follow_up(self, fn, *args):
+        # Background work a finished job asked for. It only takes an idle worker, so it never
+        # queues ahead of a user's job, and is skipped while the same work is already pending.
+        with self._lock:
+            active = [job for job in self._jobs.values() if job.state in (QUEUED, RUNNING)]
+            if len(active) >= self.max_workers or any(job.params == args for job in active):
+                logger.debug("Skipped follow-up %s%r", fn.__name__, args)
+                return
+        try:
+            self.submit(fn, *args)
+        except (QueueFullError, RuntimeError) as e:
+            logger.warning("Follow-up %s%r not submitted: %s", fn.__name__, args, e)
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+            return {'workers': self.max_workers, 'max_queue_depth': self.max_queue_depth,
+                    'queued': states.count(QUEUED), 'running': states.count(RUNNING)}
+
+    def metrics(self):
+        # Prometheus text format: stage timings, cache and job counters from every finished job,
+        # plus the current queue
+        stats = self.stats()
+        return METRICS.render(gauges={'jobs_queued': stats['queued'], 'jobs_running': stats['running'],
+                                      'workers': stats['workers'], 'max_queue_depth': stats['max_queue_depth']})
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            data = job.to_dict()
+            if job.state == QUEUED:
+                queued = sorted((j.created_at, j.id) for j in self._jobs.values() if j.state == QUEUED)
+                data['queue_position'] = [j[1] for j in queued].index(job_id) + 1
+            return data
+
+    def artifact(self, job_id, name):
+        # Stored bytes of a finished job's artifact (gzipped where ARTIFACT_TYPES says so), or None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.artifacts.get(name) if job else None
+
+    def wait_for_update(self, job_id, version, timeout=15):
+        # Blocks until the job changes past `version`; returns the new version or None if unknown
+        with self._lock:
+            self._changed.wait_for(lambda: job_id not in self._jobs or self._jobs[job_id].version > version,
+                                   timeout=timeout)
+            job = self._jobs.get(job_id)
+            return job.version if job else None
+
+
+def admission_limit():
+    # Jobs running plus queued before /process answers 429; in inference-service mode the web
+    # processes should be given the service's JOB_WORKERS and JOB_QUEUE_DEPTH
+    return int(os.environ.get('JOB_WORKERS', 2)) + int(os.environ.get('JOB_QUEUE_DEPTH', 8))
+
+
+def _make_job_queue():
+    # With INFERENCE_SERVICE_SOCKET set, jobs run in a separate inference service
+    # (inference_service.py) and this process only forwards them
+    address = os.environ.get('INFERENCE_SERVICE_SOCKET')
+    if address:
+        from inference_service import RemoteJobQueue
+        return RemoteJobQueue(address)
+    return JobQueue(max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+                    max_queue_depth=int(os.environ.get('JOB_QUEUE_DEPTH', 8)))
+
+
+job_queue = _make_job_queue()
@@ -0,0 +1,92 @@
+import numpy as np
+
+from note_table import as_transcription, pitch_class_histogram
+from telemetry import span
+
+# Krumhansl-Schmuckler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+PITCH_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+# Position of each natural tonic on the circle of fifths, for key signatures
+LETTER_FIFTHS = {'F': -1, 'C': 0, 'G': 1, 'D': 2, 'A': 3, 'E': 4, 'B': 5}
+
+# Row 2*t is t major, row 2*t+1 is t minor; each is the profile rotated to start on tonic t, so
+# histogram @ KEY_PROFILES.T equals correlating the histogram rolled by -t against the profile.
+# The interleaved order matches the old per-key loop, so ties resolve to the same key.
+KEY_MODES = ('major', 'minor') * 12
+KEY_TONICS = np.repeat(np.arange(12), 2)
+KEY_PROFILES = np.stack([np.roll(MAJOR_PROFILE if mode == 'major' else MINOR_PROFILE, tonic)
+                         for tonic, mode in zip(KEY_TONICS, KEY_MODES)])
+
+
+def score_keys(histograms):
+    # (..., 12) pitch-class histograms -> (..., 24) key scores, one matrix product for the whole batch
+    return np.asarray(histograms, dtype=np.float64) @ KEY_PROFILES.T
+
+
+class KeyCandidate:
+    __slots__ = ('tonic', 'mode', 'score')
+
+    def __init__(self, tonic, mode, score):
+        self.tonic = tonic
+        self.mode = mode
+        self.score = score
+
+    @property
+    def name(self):
+        return f"{PITCH_NAMES[self.tonic]} {self.mode}"
+
+    @property
+    def sharps(self):
+        # Key signature as music21.key.Key(...).sharps computes it for these tonic spellings
+        name = PITCH_NAMES[self.tonic]
+        fifths = LETTER_FIFTHS[name[0]] + 7 * name.count('#')
+        return fifths - 3 if self.mode == 'minor' else fifths
+
+    def to_music21(self):
+        import music21 as m21
+        return m21.key.Key(PITCH_NAMES[self.tonic], self.mode)
+
+    def to_dict(self):
+        return {'tonic': PITCH_NAMES[self.tonic], 'mode': self.mode, 'score': self.score}
+
+
+def rank_keys(histograms):
+    # A single histogram gives one ranked list of 24 candidates; a (n, 12) batch gives n lists
+    histograms = np.asarray(histograms, dtype=np.float64)
+    scores = score_keys(np.atleast_2d(histograms))
+    # Stable sort on the negated scores keeps the first-listed key on ties, like max() did; rounding
+    # first stops last-bit summation differences from deciding between genuinely tied keys
+    order = np.argsort(-np.round(scores, 12), axis=1, kind='stable')
+    ranked = [[KeyCandidate(int(KEY_TONICS[k]), KEY_MODES[k], float(row_scores[k])) for k in row_order]
+              for row_order, row_scores in zip(order, scores)]
+    return ranked[0] if histograms.ndim == 1 else ranked
+
+
+def analyze_key(midi_data):
+    # Ranked key candidates for a transcription, computed once and memoized on it
+    transcription = as_transcription(midi_data)
+    if transcription.key_analysis is None:
+        with span('key_detection'):
+            transcription.key_analysis = rank_keys(pitch_class_histogram(transcription))
+    return transcription.key_analysis
+
+
+def windowed_histograms(midi_data, window=8.0, hop=4.0):
+    # Pitch-class histograms over sliding windows, for tracking key changes through a song.
+    # Returns (window_starts, (n_windows, 12) normalized histograms); empty windows are all zero.
+    notes = as_transcription(midi_data).notes
+    end_time = float(notes['end'].max()) if len(notes) else 0.0
+    starts = np.arange(0.0, max(end_time - window, 0.0) + hop, hop)
+    # Time each note sounds inside each window, summed per pitch class with one product
+    overlap = np.clip(np.minimum(notes['end'], starts[:, np.newaxis] + window) -
+                      np.maximum(notes['start'], starts[:, np.newaxis]), 0.0, None)
+    histograms = overlap @ np.eye(12)[notes['pitch'] % 12]
+    totals = histograms.sum(axis=1, keepdims=True)
+    return starts, np.divide(histograms, totals, out=np.zeros_like(histograms), where=totals > 0)
+
+
+def key_timeline(midi_data, window=8.0, hop=4.0):
+    # Best key per sliding window: [(window_start, KeyCandidate), ...]
+    starts, histograms = windowed_histograms(midi_data, window, hop)
+    return [(float(start), ranked[0]) for start, ranked in zip(starts, rank_keys(histograms))]
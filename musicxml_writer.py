@@ -0,0 +1,251 @@
+import io
+import math
+import zipfile
+from fractions import Fraction
+from xml.sax.saxutils import XMLGenerator
+
+# Direct quantized-notes -> MusicXML writer. It does the measure splitting, ties, rests and
+# accidentals itself and streams the XML into memory, so none of music21's stream building,
+# makeMeasures or makeNotation is needed. Spelling, clefs and key signatures follow music21's
+# defaults so the output reads the same as the music21 renderer's.
+
+# music21's default spelling of each pitch class
+PITCH_SPELLINGS = [('C', 0), ('C', 1), ('D', 0), ('E', -1), ('E', 0), ('F', 0),
+                   ('F', 1), ('G', 0), ('G', 1), ('A', 0), ('B', -1), ('B', 0)]
+STEPS = 'CDEFGAB'
+SHARP_ORDER = 'FCGDAEB'
+ACCIDENTALS = {-2: 'flat-flat', -1: 'flat', 0: 'natural', 1: 'sharp', 2: 'double-sharp'}
+
+# (quarter length, type, dots), longest first, for splitting lengths into notatable pieces
+NOTE_TYPES = [(Fraction(7), 'whole', 2), (Fraction(6), 'whole', 1), (Fraction(4), 'whole', 0),
+              (Fraction(7, 2), 'half', 2), (Fraction(3), 'half', 1), (Fraction(2), 'half', 0),
+              (Fraction(7, 4), 'quarter', 2), (Fraction(3, 2), 'quarter', 1), (Fraction(1), 'quarter', 0),
+              (Fraction(7, 8), 'eighth', 2), (Fraction(3, 4), 'eighth', 1), (Fraction(1, 2), 'eighth', 0),
+              (Fraction(3, 8), '16th', 1), (Fraction(1, 4), '16th', 0),
+              (Fraction(1, 8), '32nd', 0), (Fraction(1, 16), '64th', 0)]
+
+
+def key_signature_alters(fifths):
+    alters = dict.fromkeys(STEPS, 0)
+    for i in range(abs(fifths)):
+        step = SHARP_ORDER[i % 7] if fifths > 0 else SHARP_ORDER[::-1][i % 7]
+        alters[step] += 1 if fifths > 0 else -1
+    return alters
+
+
+def best_clef(pitches):
+    # music21.clef.bestClef: average diatonic height, with a bonus pulling high and low notes outward
+    heights = []
+    for pitch in pitches:
+        step, _ = PITCH_SPELLINGS[pitch % 12]
+        height = (pitch // 12 - 1) * 7 + STEPS.index(step) + 1
+        heights.append(height + 3 if height > 33 else height - 3 if height < 24 else height)
+    average = sum(heights) / len(heights) if heights else 29.0
+    if average > 49:
+        return 'G', 2, 1
+    if average > 28:
+        return 'G', 2, 0
+    if average > 10:
+        return 'F', 4, 0
+    return 'F', 4, -1
+
+
+def notated_pieces(length):
+    # Split a length (in quarters) into tied notatable durations, e.g. 5/2 -> 2 + 1/2
+    pieces = []
+    remaining = length
+    for value, note_type, dots in NOTE_TYPES:
+        while remaining >= value:
+            pieces.append((value, note_type, dots))
+            remaining -= value
+    if remaining > 0:
+        # Finer than a 64th: fold it into the last piece rather than drop time
+        value, note_type, dots = pieces.pop() if pieces else (Fraction(0), '64th', 0)
+        pieces.append((value + remaining, note_type, dots))
+    return pieces
+
+
+def split_measures(events, measure_length):
+    # events: [(midi_pitch or None for a rest, quarter_length), ...] played back to back.
+    # Returns one list per measure of (pitch, length, type, dots, tie_start, tie_stop).
+    measures = [[]]
+    position = Fraction(0)
+    for pitch, quarter_length in events:
+        remaining = Fraction(quarter_length).limit_denominator(64)
+        if remaining <= 0:
+            continue
+        segments = []
+        while remaining > 0:
+            if position == measure_length:
+                measures.append([])
+                position = Fraction(0)
+            length = min(remaining, measure_length - position)
+            segments.append((len(measures) - 1, length))
+            position += length
+            remaining -= length
+
+        pieces = [(measure, piece) for measure, length in segments for piece in notated_pieces(length)]
+        for i, (measure, (length, note_type, dots)) in enumerate(pieces):
+            # Rests are never tied; a note split at a barline or into pieces is
+            tie_stop = pitch is not None and i > 0
+            tie_start = pitch is not None and i < len(pieces) - 1
+            measures[measure].append((pitch, length, note_type, dots, tie_start, tie_stop))
+    return measures, measure_length - position if measures[-1] else Fraction(0)
+
+
+class MusicXMLWriter:
+    def __init__(self, out, divisions):
+        self.xml = XMLGenerator(out, 'utf-8', short_empty_elements=True)
+        self.divisions = divisions
+
+    def start(self, name, attrs=None):
+        self.xml.startElement(name, attrs or {})
+
+    def end(self, name):
+        self.xml.endElement(name)
+
+    def element(self, name, text=None, attrs=None):
+        self.start(name, attrs)
+        if text is not None:
+            self.xml.characters(str(text))
+        self.end(name)
+
+    def attributes(self, fifths, mode, time_signature, clef):
+        sign, line, octave_change = clef
+        self.start('attributes')
+        self.element('divisions', self.divisions)
+        self.start('key')
+        self.element('fifths', fifths)
+        self.element('mode', mode)
+        self.end('key')
+        self.start('time')
+        self.element('beats', time_signature[0])
+        self.element('beat-type', time_signature[1])
+        self.end('time')
+        self.start('clef')
+        self.element('sign', sign)
+        self.element('line', line)
+        if octave_change:
+            self.element('clef-octave-change', octave_change)
+        self.end('clef')
+        self.end('attributes')
+
+    def note(self, pitch, length, note_type, dots, tie_start=False, tie_stop=False, accidental=None,
+             measure_rest=False, hidden=False):
+        self.start('note', {'print-object': 'no'} if hidden else None)
+        if pitch is None:
+            self.element('rest', attrs={'measure': 'yes'} if measure_rest else None)
+        else:
+            step, alter = PITCH_SPELLINGS[pitch % 12]
+            self.start('pitch')
+            self.element('step', step)
+            if alter:
+                self.element('alter', alter)
+            self.element('octave', pitch // 12 - 1)
+            self.end('pitch')
+        self.element('duration', int(length * self.divisions))
+        if tie_stop:
+            self.element('tie', attrs={'type': 'stop'})
+        if tie_start:
+            self.element('tie', attrs={'type': 'start'})
+        if not measure_rest:
+            self.element('type', note_type)
+            for _ in range(dots):
+                self.element('dot')
+        if accidental is not None:
+            self.element('accidental', ACCIDENTALS[accidental])
+        if tie_start or tie_stop:
+            self.start('notations')
+            if tie_stop:
+                self.element('tied', attrs={'type': 'stop'})
+            if tie_start:
+                self.element('tied', attrs={'type': 'start'})
+            self.end('notations')
+        self.end('note')
+
+
+def _divisions(lengths):
+    # Smallest divisions-per-quarter that makes every duration a whole number
+    return math.lcm(1, *(length.denominator for length in lengths))
+
+
+def render_musicxml(parts, fifths=0, mode='major', time_signature=(4, 4), title=None):
+    # parts: [(part_name, events), ...] with events as in split_measures. All parts are padded
+    # with whole-measure rests to the same number of measures. Returns the document as a string.
+    measure_length = Fraction(4 * time_signature[0], time_signature[1])
+    split = []
+    for name, events in parts:
+        measures, shortfall = split_measures(events, measure_length)
+        clef = best_clef([pitch for pitch, _ in events if pitch is not None])
+        split.append((name, measures, shortfall, clef))
+    n_measures = max([len(measures) for _, measures, _, _ in split] or [0])
+    key_alters = key_signature_alters(fifths)
+    divisions = _divisions([measure_length] + [shortfall for _, _, shortfall, _ in split] +
+                           [length for _, measures, _, _ in split for measure in measures
+                            for _, length, *_ in measure])
+
+    out = io.StringIO()
+    writer = MusicXMLWriter(out, divisions)
+    writer.xml.startDocument()
+    out.write('<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+              '"http://www.musicxml.org/dtds/partwise.dtd">\n')
+    writer.start('score-partwise', {'version': '4.0'})
+    if title:
+        writer.element('movement-title', title)
+    writer.start('part-list')
+    for i, (name, _, _, _) in enumerate(split, 1):
+        writer.start('score-part', {'id': f'P{i}'})
+        writer.element('part-name', name)
+        writer.end('score-part')
+    writer.end('part-list')
+
+    for i, (_, measures, shortfall, clef) in enumerate(split, 1):
+        writer.start('part', {'id': f'P{i}'})
+        for number in range(n_measures):
+            writer.start('measure', {'number': str(number + 1)})
+            if number == 0:
+                writer.attributes(fifths, mode, time_signature, clef)
+            if number >= len(measures) or not measures[number]:
+                writer.note(None, measure_length, None, 0, measure_rest=True)
+            else:
+                # Accidentals carry through the measure per step and octave, starting from the key
+                shown = {}
+                for pitch, length, note_type, dots, tie_start, tie_stop in measures[number]:
+                    accidental = None
+                    if pitch is not None:
+                        step, alter = PITCH_SPELLINGS[pitch % 12]
+                        position = (step, pitch // 12)
+                        if alter != shown.get(position, key_alters[step]) and not tie_stop:
+                            accidental = alter
+                        shown[position] = alter
+                    writer.note(pitch, length, note_type, dots, tie_start, tie_stop, accidental)
+                if number == len(measures) - 1 and shortfall:
+                    # Complete the last measure with hidden rests, as music21 does
+                    for length, note_type, dots in notated_pieces(shortfall):
+                        writer.note(None, length, note_type, dots, hidden=True)
+            if number == n_measures - 1:
+                writer.start('barline', {'location': 'right'})
+                writer.element('bar-style', 'light-heavy')
+                writer.end('barline')
+            writer.end('measure')
+        writer.end('part')
+    writer.end('score-partwise')
+    writer.xml.endDocument()
+    return out.getvalue()
+
+
+def compress_musicxml(musicxml, filename='score.musicxml'):
+    # MusicXML's own compressed format (.mxl): a zip with the score and a container pointing at it
+    if isinstance(musicxml, str):
+        musicxml = musicxml.encode('utf-8')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        # The spec asks for an uncompressed mimetype entry first
+        archive.writestr(zipfile.ZipInfo('mimetype'), 'application/vnd.recordare.musicxml', zipfile.ZIP_STORED)
+        archive.writestr('META-INF/container.xml',
+                         '<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<container><rootfiles>'
+                         f'<rootfile full-path="{filename}" media-type="application/vnd.recordare.musicxml+xml"/>'
+                         '</rootfiles></container>\n')
+        archive.writestr(filename, musicxml)
+    return buffer.getvalue()
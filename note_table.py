@@ -0,0 +1,210 @@
+import numpy as np
+
+# One row per note. `track` is the index of the MIDI instrument the note came from, so
+# multi-instrument input (e.g. Basic Pitch with multiple_pitch_bends) round-trips unchanged.
+NOTE_DTYPE = np.dtype([('start', 'f8'), ('end', 'f8'), ('pitch', 'i2'), ('velocity', 'i2'), ('track', 'i2')])
+
+ELECTRIC_PIANO_1 = 4  # pretty_midi.instrument_name_to_program("Electric Piano 1"), Basic Pitch's program
+
+
+class Transcription:
+    # Notes as a structured NumPy array; pretty_midi objects are only built by to_pretty_midi()
+    __slots__ = ('notes', 'programs', 'pitch_bends', 'key_analysis')
+
+    def __init__(self, notes, programs=(ELECTRIC_PIANO_1,), pitch_bends=None):
+        self.notes = notes
+        self.programs = list(programs)
+        # Per-track pretty_midi.PitchBend lists, passed through untouched to the exported MIDI
+        self.pitch_bends = pitch_bends or [[] for _ in self.programs]
+        self.key_analysis = None
+
+    @classmethod
+    def from_pretty_midi(cls, midi_data):
+        instruments = midi_data.instruments
+        notes = np.empty(sum(len(instrument.notes) for instrument in instruments), dtype=NOTE_DTYPE)
+        offset = 0
+        for track, instrument in enumerate(instruments):
+            rows = [(note.start, note.end, note.pitch, note.velocity, track) for note in instrument.notes]
+            notes[offset:offset + len(rows)] = rows
+            offset += len(rows)
+        return cls(notes,
+                   [instrument.program for instrument in instruments] or [ELECTRIC_PIANO_1],
+                   [list(instrument.pitch_bends) for instrument in instruments] or None)
+
+    @classmethod
+    def from_note_events(cls, note_events, program=ELECTRIC_PIANO_1):
+        # (start, end, pitch, amplitude[, ...]) tuples as produced by Basic Pitch, velocity scaled as it does
+        notes = np.empty(len(note_events), dtype=NOTE_DTYPE)
+        if len(note_events):
+            events = np.array([event[:4] for event in note_events], dtype=np.float64)
+            notes['start'] = events[:, 0]
+            notes['end'] = events[:, 1]
+            notes['pitch'] = events[:, 2]
+            notes['velocity'] = np.round(127 * events[:, 3])
+            notes['track'] = 0
+        return cls(notes, [program])
+
+    def to_pretty_midi(self):
+        import pretty_midi
+
+        midi_data = pretty_midi.PrettyMIDI()
+        for track, program in enumerate(self.programs):
+            instrument = pretty_midi.Instrument(program=program)
+            rows = self.notes[self.notes['track'] == track]
+            instrument.notes = [pretty_midi.Note(velocity=velocity, pitch=pitch, start=start, end=end)
+                                for start, end, pitch, velocity, _ in rows.tolist()]
+            instrument.pitch_bends = list(self.pitch_bends[track])
+            midi_data.instruments.append(instrument)
+        return midi_data
+
+    def write(self, fp):
+        self.to_pretty_midi().write(fp)
+
+    @property
+    def durations(self):
+        return self.notes['end'] - self.notes['start']
+
+    def get_end_time(self):
+        # Same as PrettyMIDI.get_end_time for the events we keep: the last note off or pitch bend
+        times = [float(self.notes['end'].max())] if len(self.notes) else []
+        times += [bend.time for bends in self.pitch_bends for bend in bends]
+        return max(times) if times else 0.0
+
+    def with_notes(self, notes):
+        return Transcription(notes, self.programs, self.pitch_bends)
+
+    def sliced(self, start, end=None):
+        # The notes sounding within [start, end), trimmed to it and shifted so the selection starts at 0
+        import pretty_midi
+
+        end = np.inf if end is None else end
+        notes = self.notes[(self.notes['end'] > start) & (self.notes['start'] < end)].copy()
+        notes['start'] = np.maximum(notes['start'], start) - start
+        notes['end'] = np.minimum(notes['end'], end) - start
+        pitch_bends = [[pretty_midi.PitchBend(bend.pitch, bend.time - start) for bend in bends if start <= bend.time < end]
+                       for bends in self.pitch_bends]
+        return Transcription(notes, self.programs, pitch_bends)
+
+
+def as_transcription(notes):
+    # Accept either representation at the module boundaries
+    if isinstance(notes, Transcription):
+        return notes
+    return Transcription.from_pretty_midi(notes)
+
+
+def pitch_class_histogram(transcription):
+    # Total sounding time per pitch class, normalized to sum to one; all zero with no notes
+    notes = transcription.notes
+    histogram = np.bincount(notes['pitch'] % 12, weights=notes['end'] - notes['start'], minlength=12)
+    total = np.sum(histogram)
+    return histogram / total if total > 0 else histogram
+
+
+def scale_mask(pitches, scale_pitch_classes):
+    in_scale = np.zeros(12, dtype=bool)
+    in_scale[list(scale_pitch_classes)] = True
+    return in_scale[np.asarray(pitches) % 12]
+
+
+def _segmented_running_max(ranks, group):
+    # Running maximum that restarts at every new group (group ids must be non-decreasing), done on
+    # integer ranks so the result is exact rather than offset-and-subtract float arithmetic.
+    # Returns, for each position, the rank of the group's largest value so far.
+    n = len(ranks)
+    return np.maximum.accumulate(group * n + ranks) - group * n
+
+
+# Passes of the vectorized merge before falling back to the sequential walk. Each pass settles
+# at least one more link of every chain, so a legato line (a held note followed by a run of
+# notes each starting before the merged end) can need one pass per note.
+MAX_MERGE_PASSES = 8
+
+
+def _merge_groups_sequential(notes, in_scale, max_gap, pitch_tolerance):
+    # The merge as a single walk over the notes; linear, but a Python loop
+    n = len(notes)
+    starts = notes['start'].tolist()
+    ends = notes['end'].tolist()
+    pitches = notes['pitch'].tolist()
+    tracks = notes['track'].tolist()
+    in_scale = in_scale.tolist()
+    group = np.empty(n, dtype=np.int64)
+    merged_end = np.empty(n, dtype=np.float64)
+    merged_pitch = np.empty(n, dtype=np.int64)
+
+    current_group, current_end, current_pitch, has_in_scale = -1, 0.0, 0, False
+    for i in range(n):
+        if (i == 0 or tracks[i] != tracks[i - 1] or abs(pitches[i] - current_pitch) > pitch_tolerance or
+                starts[i] - current_end > max_gap):
+            current_group += 1
+            current_end, current_pitch, has_in_scale = ends[i], pitches[i], in_scale[i]
+        else:
+            current_end = max(current_end, ends[i])
+            if in_scale[i] and not has_in_scale:
+                current_pitch, has_in_scale = pitches[i], True
+        group[i], merged_end[i], merged_pitch[i] = current_group, current_end, current_pitch
+    return group, merged_end, merged_pitch
+
+
+def merge_groups(notes, in_scale, max_gap, pitch_tolerance):
+    # Vectorized form of the sequential merge: walking the notes in order, a note joins the
+    # current merged note when its pitch is within pitch_tolerance of the merged pitch and it
+    # starts at most max_gap after the merged end. The merged end is the running max of the
+    # group's ends and the merged pitch switches to the first in-scale member's pitch.
+    # Each link depends only on earlier links, so iterating to a fixed point reproduces the
+    # sequential result exactly. Short chains settle in a few passes; long legato chains can
+    # take one pass per note, so after MAX_MERGE_PASSES the sequential walk finishes the job.
+    n = len(notes)
+    index = np.arange(n)
+    start = notes['start']
+    end = notes['end']
+    pitch = notes['pitch'].astype(np.int64)
+    same_track = np.zeros(n, dtype=bool)
+    same_track[1:] = notes['track'][1:] == notes['track'][:-1]
+
+    order = np.argsort(end, kind='stable')
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = index
+    candidate = np.where(in_scale, index, n)
+
+    link = np.zeros(n, dtype=bool)
+    for _ in range(MAX_MERGE_PASSES):
+        group = np.cumsum(~link) - 1
+        first = np.flatnonzero(~link)[group]
+        merged_end = end[order[_segmented_running_max(ranks, group)]]
+        # Index of the first in-scale member seen so far in each group, or n if none yet
+        first_in_scale = n - (np.maximum.accumulate(group * (n + 1) + (n - candidate)) - group * (n + 1))
+        merged_pitch = np.where(first_in_scale < n, pitch[np.minimum(first_in_scale, n - 1)], pitch[first])
+
+        new_link = same_track.copy()
+        new_link[1:] &= ((np.abs(pitch[1:] - merged_pitch[:-1]) <= pitch_tolerance) &
+                         (start[1:] - merged_end[:-1] <= max_gap))
+        if np.array_equal(new_link, link):
+            return group, merged_end, merged_pitch
+        link = new_link
+    return _merge_groups_sequential(notes, in_scale, max_gap, pitch_tolerance)
+
+
+def merge_notes(notes, scale_pitch_classes, max_gap=0.15, min_duration=0.075, pitch_tolerance=1,
+                long_note_threshold=0.5):
+    # Merge nearby notes, drop merged notes shorter than min_duration, then drop out-of-key
+    # notes unless they last longer than long_note_threshold seconds
+    if len(notes) == 0:
+        return notes.copy()
+    in_scale = scale_mask(notes['pitch'], scale_pitch_classes)
+    group, merged_end, merged_pitch = merge_groups(notes, in_scale, max_gap, pitch_tolerance)
+
+    firsts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    lasts = np.r_[firsts[1:], len(notes)] - 1
+    merged = np.empty(len(firsts), dtype=NOTE_DTYPE)
+    merged['start'] = notes['start'][firsts]
+    merged['end'] = merged_end[lasts]
+    merged['pitch'] = merged_pitch[lasts]
+    merged['velocity'] = np.maximum.reduceat(notes['velocity'], firsts)
+    merged['track'] = notes['track'][firsts]
+
+    durations = merged['end'] - merged['start']
+    merged = merged[durations >= min_duration]
+    durations = merged['end'] - merged['start']
+    return merged[scale_mask(merged['pitch'], scale_pitch_classes) | (durations > long_note_threshold)]
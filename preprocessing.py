@@ -0,0 +1,96 @@
+import time
+import numpy as np
+
+# librosa and scipy are imported inside the filters: the web process imports this module only
+# for PREPROCESS_MODES and must not pay for the DSP stack at startup
+
+# Preprocessing modes, from slowest/highest quality to fastest:
+#   hpss      - full-resolution harmonic/percussive separation (the original behaviour)
+#   hpss_fast - HPSS on a downsampled signal with a smaller median kernel
+#   bandpass  - IIR band-pass around the vocal range, no separation at all
+#   none      - pass the audio through untouched
+PREPROCESS_MODES = ('hpss', 'hpss_fast', 'bandpass', 'none')
+DEFAULT_PREPROCESS_MODE = 'hpss'
+# Part of the cache keys, so changing the noise reducer never serves stale activations
+NOISE_REDUCER = 'spectral_gate'
+
+
+def hpss_full(y, sr):
+    import librosa
+    return librosa.effects.hpss(y)[0]
+
+
+def hpss_fast(y, sr, target_sr=11025, kernel_size=15):
+    # Sung pitch lives well below 5.5 kHz, so separating at half the rate with a smaller
+    # median kernel costs a fraction of the full HPSS for much the same harmonic content
+    import librosa
+    y_low = librosa.resample(y, orig_sr=sr, target_sr=target_sr) if sr > target_sr else y
+    stft = librosa.stft(y_low, n_fft=1024, hop_length=256)
+    harmonic, _ = librosa.decompose.hpss(stft, kernel_size=kernel_size)
+    y_harmonic = librosa.istft(harmonic, hop_length=256, length=len(y_low))
+    if sr > target_sr:
+        y_harmonic = librosa.resample(y_harmonic, orig_sr=target_sr, target_sr=sr)
+    return librosa.util.fix_length(y_harmonic, size=len(y)).astype(np.float32)
+
+
+def vocal_bandpass(y, sr, low=80.0, high=4000.0, order=4):
+    # Butterworth band-pass as second-order sections: one linear pass over the samples
+    from scipy import signal
+    sos = signal.butter(order, [low, min(high, sr / 2 * 0.95)], btype='bandpass', fs=sr, output='sos')
+    return signal.sosfilt(sos, y).astype(np.float32)
+
+
+def spectral_gate(y, sr, n_fft=2048, hop_length=512, noise_quantile=0.1, n_std=1.5,
+                  softness=2.0, prop_decrease=1.0, smooth_frames=3, smooth_bins=3):
+    # Stationary spectral gating: the quietest frames give a per-bin noise floor (mean and spread
+    # in dB), every bin is attenuated by a soft sigmoid mask on its distance above that floor, and
+    # the masked STFT is overlap-added back. Each step is linear in the number of frames.
+    import librosa
+    from scipy import ndimage
+
+    if len(y) < n_fft:
+        return y
+    stft = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+    magnitude = np.abs(stft)
+    magnitude_db = librosa.amplitude_to_db(magnitude, ref=1.0, amin=1e-10)
+
+    # Rank frames by linear power: a sung partial barely moves the mean in dB, and voiced
+    # frames leaking into the noise profile would gate the voice itself
+    frame_energy = np.einsum('ft,ft->t', magnitude, magnitude)
+    n_noise = max(1, int(noise_quantile * len(frame_energy)))
+    noise_frames = np.argpartition(frame_energy, n_noise - 1)[:n_noise]
+    noise_db = magnitude_db[:, noise_frames]
+    threshold = (noise_db.mean(axis=1) + n_std * noise_db.std(axis=1))[:, np.newaxis]
+
+    mask = 1.0 / (1.0 + np.exp(-(magnitude_db - threshold) / softness))
+    if smooth_frames > 1 or smooth_bins > 1:
+        # Smoothing the mask avoids the "musical noise" of isolated bins switching on and off
+        mask = ndimage.uniform_filter(mask, size=(smooth_bins, smooth_frames), mode='nearest')
+    mask = 1.0 - prop_decrease * (1.0 - mask)
+
+    y_denoised = librosa.istft(stft * mask, hop_length=hop_length, length=len(y))
+    return y_denoised.astype(np.float32)
+
+
+PREPROCESSORS = {
+    'hpss': hpss_full,
+    'hpss_fast': hpss_fast,
+    'bandpass': vocal_bandpass,
+    'none': lambda y, sr: y,
+}
+
+
+def reduce_noise(y, sr):
+    # Returns the denoised signal and how long the gate took, in seconds
+    start_time = time.time()
+    y = spectral_gate(y, sr)
+    return y, time.time() - start_time
+
+
+def apply_preprocessing(y, sr, mode=DEFAULT_PREPROCESS_MODE):
+    # Returns the filtered signal and how long the filter took, in seconds
+    if mode not in PREPROCESSORS:
+        raise ValueError(f"Unknown preprocessing mode '{mode}', expected one of {', '.join(PREPROCESS_MODES)}")
+    start_time = time.time()
+    y = PREPROCESSORS[mode](y, sr)
+    return y, time.time() - start_time
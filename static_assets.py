@@ -0,0 +1,127 @@
+import os
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+
+# Build-time processing of heavy static files, and the runtime lookups that serve the result.
+# `python static_assets.py` (run by bin/post_compile and vercel_build.sh) copies every source
+# asset to a content-hashed name under static/build with gzip (and, when the brotli package is
+# installed, brotli) variants next to it. Hashed names never change content, so they are served
+# as immutable.
+
+SOURCE_DIRS = ('soundfonts',)
+BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'build')
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Precompressed variants in order of preference, by Content-Encoding
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def hashed_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+
+def _compressors():
+    compressors = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        compressors['br'] = lambda data: brotli.compress(data, quality=11)
+    except ImportError:
+        print("brotli is not installed; building gzip variants only", file=sys.stderr)
+    return compressors
+
+
+def write_asset(build_dir, name, data, compressors):
+    # Writes data under its hashed name plus any variant that is meaningfully smaller; returns
+    # the hashed name relative to build_dir
+    hashed = hashed_name(name, data)
+    path = os.path.join(build_dir, hashed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    for encoding, suffix in ENCODINGS:
+        if encoding in compressors:
+            compressed = compressors[encoding](data)
+            # Already-compressed audio gains nothing; don't make clients negotiate for it
+            if len(compressed) < 0.9 * len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+    return hashed
+
+
+def build(static_dir='static', build_dir=BUILD_DIR):
+    compressors = _compressors()
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    manifest = {'assets': {}}
+
+    for source_dir in SOURCE_DIRS:
+        for filename in sorted(os.listdir(os.path.join(static_dir, source_dir))):
+            name = f"{source_dir}/{filename}"
+            with open(os.path.join(static_dir, name), 'rb') as f:
+                manifest['assets'][name] = write_asset(build_dir, name, f.read(), compressors)
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+_manifest = None
+
+
+def manifest():
+    # Loaded once per process; empty until the build has run, in which case the app falls back to
+    # serving the source files
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(BUILD_DIR, MANIFEST_NAME)) as f:
+                loaded = json.load(f)
+        except FileNotFoundError:
+            loaded = {'assets': {}}
+        loaded['served'] = set(loaded['assets'].values())
+        _manifest = loaded
+    return _manifest
+
+
+def asset_path(name):
+    # 'soundfonts/acoustic_grand_piano-mp3.js' -> its hashed path under BUILD_DIR, or None before a build
+    return manifest()['assets'].get(name)
+
+
+def negotiate(path, accept_encodings):
+    # The hashed file to send for `path` and its Content-Encoding, or (None, None) if it isn't built
+    if path not in manifest()['served']:
+        return None, None
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] and os.path.exists(os.path.join(BUILD_DIR, path + suffix)):
+            return path + suffix, encoding
+    return path, None
+
+
+def etag(path, encoding):
+    # The content hash is already in the name, so the tag is the same on every host and build
+    return f"{os.path.splitext(path)[0].rsplit('.', 1)[-1]}-{encoding or 'identity'}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build hashed, precompressed static assets.")
+    parser.add_argument('--static-dir', default='static')
+    parser.add_argument('--build-dir', default=BUILD_DIR)
+    args = parser.parse_args()
+
+    built = build(args.static_dir, args.build_dir)
+    for name, path in built['assets'].items():
+        print(f"{name} -> {path}")
+
+
+if __name__ == "__main__":
+    main()
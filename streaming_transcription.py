@@ -0,0 +1,121 @@
+import os
+import time
+import logging
+import argparse
+import numpy as np
+import librosa
+import soundfile as sf
+
+from inference_engine import get_engine
+from note_table import Transcription
+from preprocessing import PREPROCESS_MODES, DEFAULT_PREPROCESS_MODE
+from telemetry import configure_logging
+from vocal_parts_to_sheet_music import (preprocess_audio, merge_nearby_notes, create_sheet_music,
+                                        quantize_duration_extended)
+
+# Notes ending this close to a block edge may continue into the next block
+EDGE_TOLERANCE = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def iter_audio_blocks(audio_path, block_seconds=30.0, overlap_seconds=4.0, sr=22050):
+    # Read the file in overlapping blocks so memory stays bounded whatever the song length.
+    # Yields (block_start_seconds, mono_float32_block, is_last)
+    info = sf.info(audio_path)
+    blocksize = int(block_seconds * info.samplerate)
+    overlap = int(overlap_seconds * info.samplerate)
+    step = blocksize - overlap
+    n_blocks = max(1, int(np.ceil(max(info.frames - overlap, 1) / step)))
+
+    blocks = sf.blocks(audio_path, blocksize=blocksize, overlap=overlap, dtype='float32', always_2d=True)
+    for i, block in enumerate(blocks):
+        y = block.mean(axis=1)
+        if info.samplerate != sr:
+            y = librosa.resample(y, orig_sr=info.samplerate, target_sr=sr)
+        yield i * step / info.samplerate, y, i >= n_blocks - 1
+        if i >= n_blocks - 1:
+            break
+
+
+def transcribe_stream(audio_path, block_seconds=30.0, overlap_seconds=4.0, skip_noise_reduction=True,
+                      onset_threshold=0.5, frame_threshold=0.3, minimum_note_length=0.058,
+                      minimum_frequency=65, maximum_frequency=2093, melodia_trick=True,
+                      preprocess_mode=DEFAULT_PREPROCESS_MODE):
+    # Generator of partial note lists [(start, end, pitch, amplitude), ...] in song time.
+    # Each block owns the notes that start between the midpoints of its overlaps with its
+    # neighbours, so a note seen by two blocks is emitted once; notes cut off at a block edge
+    # are held back and extended by the matching note in the next block.
+    engine = get_engine()
+    half_overlap = overlap_seconds / 2
+    held = []
+
+    for block_start, y, is_last in iter_audio_blocks(audio_path, block_seconds, overlap_seconds):
+        start_time = time.time()
+        block_end = block_start + len(y) / 22050
+        y, sr = preprocess_audio(None, skip_noise_reduction, audio=(y, 22050), preprocess_mode=preprocess_mode)
+        _, _, note_events = engine.notes_from_output(engine.run_model(y, sr),
+                                                     onset_threshold=onset_threshold,
+                                                     frame_threshold=frame_threshold,
+                                                     minimum_note_length=minimum_note_length,
+                                                     minimum_frequency=minimum_frequency,
+                                                     maximum_frequency=maximum_frequency,
+                                                     melodia_trick=melodia_trick)
+        notes = sorted((block_start + float(start), block_start + float(end), int(pitch), float(amplitude))
+                       for start, end, pitch, amplitude, _ in note_events)
+
+        own_start = block_start + half_overlap if block_start > 0 else 0.0
+        own_end = block_end - half_overlap if not is_last else np.inf
+
+        # Stitch held notes with their continuation: the same pitch sounding across the old block edge
+        finished = []
+        continued = set()
+        for note in held:
+            continuation = [n for n in notes if n[2] == note[2] and n[0] <= note[1] + EDGE_TOLERANCE < n[1]]
+            if continuation:
+                continued.update(continuation)
+                note = (note[0], max(n[1] for n in continuation), note[2], max(note[3], continuation[0][3]))
+            finished.append(note)
+
+        owned = [n for n in notes if own_start <= n[0] < own_end and n not in continued]
+        held = []
+        for note in owned:
+            if not is_last and note[1] >= block_end - EDGE_TOLERANCE:
+                held.append(note)
+            else:
+                finished.append(note)
+
+        logger.info("Block at %.1fs transcribed in %.2f seconds (%d notes)",
+                    block_start, time.time() - start_time, len(finished))
+        yield sorted(finished)
+
+    if held:
+        yield sorted(held)
+
+
+def transcribe_stream_to_midi(audio_path, merge_max_gap=0.15, merge_min_duration=0.075, merge_pitch_tolerance=1,
+                              **kwargs):
+    notes = [note for partial in transcribe_stream(audio_path, **kwargs) for note in partial]
+    return merge_nearby_notes(Transcription.from_note_events(notes), max_gap=merge_max_gap,
+                              min_duration=merge_min_duration, pitch_tolerance=merge_pitch_tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a full-length song in bounded memory, block by block.")
+    parser.add_argument('audio_path')
+    parser.add_argument('--output', default='data/sheet_music/vocal_sheet_music.xml')
+    parser.add_argument('--block-seconds', type=float, default=30.0)
+    parser.add_argument('--overlap-seconds', type=float, default=4.0)
+    parser.add_argument('--preprocess-mode', choices=PREPROCESS_MODES, default=DEFAULT_PREPROCESS_MODE)
+    args = parser.parse_args()
+
+    configure_logging()
+    midi_data = transcribe_stream_to_midi(args.audio_path, block_seconds=args.block_seconds,
+                                          overlap_seconds=args.overlap_seconds,
+                                          preprocess_mode=args.preprocess_mode)
+    create_sheet_music(midi_data, None, args.output, quantize_duration_extended, "streamed",
+                       input_filename=os.path.basename(args.audio_path))
+
+
+if __name__ == "__main__":
+    main()
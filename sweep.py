@@ -0,0 +1,167 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import itertools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocessing import PREPROCESS_MODES, DEFAULT_PREPROCESS_MODE
+
+# Parameter sweeps over note extraction and merging. Each audio file is preprocessed and run
+# through the model once; every configuration in the grid is then only note extraction, merging
+# and rendering from the same activations, fanned out across a process pool.
+
+# Sweepable parameters, their types and the values swept when none are given
+SWEEP_PARAMETERS = {
+    'onset_threshold': (float, [0.4, 0.5, 0.6]),
+    'frame_threshold': (float, [0.2, 0.3, 0.4]),
+    'minimum_note_length': (float, [0.058]),
+    'merge_max_gap': (float, [0.1, 0.15, 0.2]),
+    'merge_min_duration': (float, [0.075]),
+    'merge_pitch_tolerance': (int, [1]),
+}
+
+_activations = {}
+
+
+def expand_grid(grid):
+    # {'onset_threshold': [0.4, 0.5], ...} -> [{'onset_threshold': 0.4, ...}, ...] in product order
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _init_worker(activations):
+    # Each worker receives the activations once, instead of once per configuration
+    global _activations
+    _activations = activations
+    # Import the extraction stack up front so it isn't timed as part of the first configuration
+    import vocal_parts_to_sheet_music  # noqa: F401
+    from basic_pitch import note_creation  # noqa: F401
+
+
+def evaluate(analysis_id, config, render=True):
+    from vocal_parts_to_sheet_music import notes_from_activations, create_sheet_music, quantize_duration_extended
+    from key_analysis import analyze_key
+
+    # The pipeline reports key detection on stdout; keep it off the table
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        transcription = notes_from_activations(_activations[analysis_id], **config)
+        extract_seconds = time.perf_counter() - start
+
+        durations = transcription.durations
+        row = dict(config,
+                   notes=len(transcription.notes),
+                   total_duration=float(durations.sum()),
+                   mean_duration=float(durations.mean()) if len(transcription.notes) else 0.0,
+                   key=analyze_key(transcription)[0].name if len(transcription.notes) else '',
+                   extract_seconds=extract_seconds,
+                   render_seconds=0.0,
+                   musicxml=None)
+
+        if render and len(transcription.notes):
+            start = time.perf_counter()
+            row['musicxml'] = create_sheet_music(transcription, None, "memory", quantize_duration_extended, '')
+            row['render_seconds'] = time.perf_counter() - start
+    return row
+
+
+def _evaluate_task(task):
+    return evaluate(*task)
+
+
+def sweep(audio_paths, grid, workers=None, render=True, preprocess_mode=DEFAULT_PREPROCESS_MODE):
+    from vocal_parts_to_sheet_music import load_activations
+
+    configs = expand_grid(grid)
+    activations = {}
+    rows = []
+    for audio_path in audio_paths:
+        start = time.perf_counter()
+        analysis_id, audio_activations = load_activations(audio_path, skip_noise_reduction=True,
+                                                          preprocess_mode=preprocess_mode)
+        activations[analysis_id] = audio_activations
+        print(f"Activations for {audio_path} ready in {time.perf_counter() - start:.2f} seconds", file=sys.stderr)
+        rows.extend({'audio': os.path.basename(audio_path), 'analysis_id': analysis_id, 'config': config}
+                    for config in configs)
+
+    tasks = [(row['analysis_id'], row['config'], render) for row in rows]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    start = time.perf_counter()
+    if workers <= 1:
+        _init_worker(activations)
+        results = [_evaluate_task(task) for task in tasks]
+    else:
+        # spawn rather than fork, as for the job workers; extraction needs no model, so workers start fast
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(activations,)) as executor:
+            results = list(executor.map(_evaluate_task, tasks,
+                                        chunksize=max(1, len(tasks) // (workers * 4))))
+    print(f"Evaluated {len(tasks)} configurations in {time.perf_counter() - start:.2f} seconds "
+          f"with {workers} worker(s)", file=sys.stderr)
+
+    return [dict(result, audio=row['audio']) for row, result in zip(rows, results)]
+
+
+def print_table(rows, names, file=sys.stdout):
+    columns = ['audio'] + names + ['notes', 'total_duration', 'mean_duration', 'key', 'extract_seconds', 'render_seconds']
+    widths = {column: max(len(column), *(len(_format(row[column])) for row in rows)) for column in columns}
+    print('  '.join(column.rjust(widths[column]) for column in columns), file=file)
+    for row in rows:
+        print('  '.join(_format(row[column]).rjust(widths[column]) for column in columns), file=file)
+
+
+def _format(value):
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def write_csv(rows, names, path):
+    columns = ['audio'] + names + ['notes', 'total_duration', 'mean_duration', 'key', 'extract_seconds', 'render_seconds']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_musicxml(rows, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for i, row in enumerate(rows):
+        if row['musicxml'] is not None:
+            with open(os.path.join(output_dir, f"{os.path.splitext(row['audio'])[0]}_config{i}.xml"), 'w',
+                      encoding='utf-8') as f:
+                f.write(row['musicxml'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep note extraction parameters over shared activations.")
+    parser.add_argument('audio_paths', nargs='+')
+    for name, (cast, default) in SWEEP_PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=cast, nargs='+', default=default)
+    parser.add_argument('--preprocess-mode', choices=PREPROCESS_MODES, default=DEFAULT_PREPROCESS_MODE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-render', action='store_true', help="Skip MusicXML rendering")
+    parser.add_argument('--csv', help="Also write the comparison table to this CSV file")
+    parser.add_argument('--output-dir', help="Write each configuration's MusicXML here")
+    args = parser.parse_args()
+
+    grid = {name: getattr(args, name) for name in SWEEP_PARAMETERS}
+    # Only parameters that vary are worth a column
+    names = [name for name, values in grid.items() if len(values) > 1]
+
+    rows = sweep(args.audio_paths, grid, args.workers, not args.no_render, args.preprocess_mode)
+    print_table(rows, names)
+    if args.csv:
+        write_csv(rows, names, args.csv)
+        print(f"Comparison table written to {args.csv}", file=sys.stderr)
+    if args.output_dir:
+        write_musicxml(rows, args.output_dir)
+        print(f"MusicXML written to {args.output_dir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import defaultdict
+
+# Tracing and metrics for the transcription pipeline. Stages are timed with span() and events
+# counted with count(). Inside a job (traced()), both are collected on the job's Trace, which
+# travels back to the process that owns the job queue with the result and is merged into METRICS
+# there; outside a job they go straight into this process's METRICS. METRICS renders in the
+# Prometheus text format for /metrics.
+
+METRIC_PREFIX = 'vocaltranscription_'
+# Histogram buckets in seconds, from a cached key lookup to a full HPSS pass on a long song
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+METRIC_HELP = {
+    'stage_seconds': ('histogram', 'Time spent in each pipeline stage'),
+    'cache_requests_total': ('counter', 'Cache lookups (notes, activations, search, previews) by result'),
+    'jobs_total': ('counter', 'Finished jobs by final state'),
+    'job_queue_wait_seconds': ('histogram', 'Time jobs spent queued before a worker picked them up'),
+    'job_seconds': ('histogram', 'Time from submission to completion'),
+    'jobs_queued': ('gauge', 'Jobs waiting for a worker'),
+    'jobs_running': ('gauge', 'Jobs being processed'),
+    'workers': ('gauge', 'Worker processes in the job pool'),
+    'max_queue_depth': ('gauge', 'Jobs allowed to wait beyond the running ones'),
+}
+
+logger = logging.getLogger(__name__)
+
+_trace = contextvars.ContextVar('trace', default=None)
+_job_id = contextvars.ContextVar('job_id', default=None)
+
+
+class Metrics:
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def merge(self, trace):
+        # A job's spans and counts, recorded in a worker process
+        for name, seconds in trace['spans']:
+            self.observe('stage_seconds', seconds, stage=name)
+        for name, labels, value in trace['counts']:
+            self.inc(name, value, **dict(labels))
+
+    def render(self, gauges=None):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+        series = defaultdict(list)
+        for (name, labels), value in counters:
+            series[name].append(f"{METRIC_PREFIX}{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), values in histograms:
+            for bound, count in zip(self.buckets, values):
+                series[name].append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+            series[name].append(f"{METRIC_PREFIX}{name}_bucket{_labels(labels + (('le', '+Inf'),))} {values[-2]}")
+            series[name].append(f"{METRIC_PREFIX}{name}_sum{_labels(labels)} {_number(values[-1])}")
+            series[name].append(f"{METRIC_PREFIX}{name}_count{_labels(labels)} {values[-2]}")
+        for name, value in (gauges or {}).items():
+            series[name].append(f"{METRIC_PREFIX}{name} {_number(value)}")
+        for name, samples in series.items():
+            kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+METRICS = Metrics()
+
+
+class Trace:
+    def __init__(self):
+        self.spans = []
+        self.counts = defaultdict(int)
+
+    def to_dict(self):
+        # Plain tuples and lists so it pickles cheaply back from the worker
+        return {'spans': list(self.spans),
+                'counts': [(name, labels, value) for (name, labels), value in self.counts.items()]}
+
+
+@contextlib.contextmanager
+def traced(job_id):
+    trace = Trace()
+    trace_token, job_token = _trace.set(trace), _job_id.set(job_id)
+    try:
+        yield trace
+    finally:
+        _trace.reset(trace_token)
+        _job_id.reset(job_token)
+
+
+@contextlib.contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _trace.get()
+        if trace is not None:
+            trace.spans.append((name, elapsed))
+        else:
+            METRICS.observe('stage_seconds', elapsed, stage=name)
+        logger.debug("%s took %.3f seconds", name, elapsed, extra={'span': name, 'duration_ms': round(elapsed * 1000, 3)})
+
+
+def count(name, value=1, **labels):
+    trace = _trace.get()
+    if trace is not None:
+        trace.counts[(name, tuple(sorted(labels.items())))] += value
+    else:
+        METRICS.inc(name, value, **labels)
+
+
+def timings(spans):
+    # [(name, seconds), ...] -> {name: milliseconds}, summing repeated stages, in first-seen order
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds * 1000
+    return {name: round(ms, 3) for name, ms in totals.items()}
+
+
+def server_timing_header(timings):
+    return ', '.join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+class JobIdFilter(logging.Filter):
+    # Tag every record with the job it was logged for, if any
+    def filter(self, record):
+        record.job_id = _job_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # Fields passed with extra= (span, duration_ms, ...) are kept as structured fields
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        data = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                'message': record.getMessage()}
+        data.update((key, value) for key, value in vars(record).items()
+                    if key not in self.RESERVED and value is not None)
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def configure_logging(level=None):
+    # LOG_LEVEL picks the level (INFO by default); LOG_FORMAT=json emits one JSON object per line.
+    # Records below the level are dropped before their message is ever formatted.
+    level = level or os.environ.get('LOG_LEVEL', 'INFO').upper()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(JobIdFilter())
+    if os.environ.get('LOG_FORMAT') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
@@ -0,0 +1,251 @@
+import os
+import io
+import json
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from telemetry import count
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached payload format changes so old entries are never misread
+CACHE_VERSION = 2
+
+
+def audio_fingerprint(y, sr):
+    # Hash of the decoded samples, so identical audio hits the cache whatever its file name
+    digest = hashlib.sha256()
+    digest.update(str(int(sr)).encode())
+    digest.update(np.ascontiguousarray(y, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(fingerprint, **params):
+    payload = json.dumps({'version': CACHE_VERSION, 'audio': fingerprint, 'params': params},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DirectoryBackend:
+    # One file per entry; file mtime doubles as the LRU timestamp
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, suffix='.pkl'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}{self.suffix}")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another worker since the read; the data is still good
+            pass
+        return data
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def set(self, key, data):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        # Atomic rename so concurrent readers never see a partial entry
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class MemoryBackend:
+    # In-process key-value store with the same interface, standing in for an external cache server
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def set(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class TranscriptionCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        start_time = time.time()
+        data = self.backend.get(key)
+        if data is None:
+            self.misses += 1
+            count('cache_requests_total', cache='notes', result='miss')
+            return None
+        self.hits += 1
+        count('cache_requests_total', cache='notes', result='hit')
+        value = pickle.loads(data)
+        logger.info("Transcription cache hit for %s (%.3f seconds)", key[:12], time.time() - start_time)
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ActivationStore:
+    # Raw frame/onset/contour activations as float16 .npz, so note extraction can be rerun
+    # with new thresholds without touching the model
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        data = self.backend.get(key)
+        if data is None:
+            self.misses += 1
+            count('cache_requests_total', cache='activations', result='miss')
+            return None
+        self.hits += 1
+        count('cache_requests_total', cache='activations', result='hit')
+        with np.load(io.BytesIO(data)) as arrays:
+            return {k: arrays[k].astype(np.float32) for k in arrays.files}
+
+    def set(self, key, activations):
+        buffer = io.BytesIO()
+        np.savez(buffer, **{k: v.astype(np.float16) for k, v in activations.items()})
+        self.backend.set(key, buffer.getvalue())
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class PreviewCache:
+    # Downloaded preview audio, keyed by URL, so a search can fetch it before /process asks for it
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def __contains__(self, url):
+        # Not counted as a lookup
+        return self._key(url) in self.backend
+
+    def get(self, url):
+        data = self.backend.get(self._key(url))
+        if data is None:
+            self.misses += 1
+            count('cache_requests_total', cache='previews', result='miss')
+            return None
+        self.hits += 1
+        count('cache_requests_total', cache='previews', result='hit')
+        return data
+
+    def set(self, url, data):
+        self.backend.set(self._key(url), data)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def quantize_activations(activations):
+    # Round to the stored precision so fresh and cached activations yield identical notes
+    return {k: v.astype(np.float16).astype(np.float32) for k, v in activations.items()}
+
+
+def _make_backend(directory, max_mb, suffix):
+    max_bytes = int(float(max_mb) * 1024 * 1024)
+    if os.environ.get('TRANSCRIPTION_CACHE_BACKEND', 'directory') == 'memory':
+        return MemoryBackend(max_bytes)
+    return DirectoryBackend(directory, max_bytes, suffix)
+
+
+_cache = None
+_activation_store = None
+_preview_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TranscriptionCache(_make_backend(os.environ.get('TRANSCRIPTION_CACHE_DIR', 'data/cache/transcriptions'),
+                                                  os.environ.get('TRANSCRIPTION_CACHE_MAX_MB', 512), '.pkl'))
+    return _cache
+
+
+def get_activation_store():
+    global _activation_store
+    if _activation_store is None:
+        _activation_store = ActivationStore(_make_backend(os.environ.get('ACTIVATION_CACHE_DIR', 'data/cache/activations'),
+                                                          os.environ.get('ACTIVATION_CACHE_MAX_MB', 1024), '.npz'))
+    return _activation_store
+
+
+def get_preview_cache():
+    # On disk by default so job workers see what the web process prefetched
+    global _preview_cache
+    if _preview_cache is None:
+        _preview_cache = PreviewCache(_make_backend(os.environ.get('PREVIEW_CACHE_DIR', 'data/cache/previews'),
+                                                    os.environ.get('PREVIEW_CACHE_MAX_MB', 256), '.bin'))
+    return _preview_cache
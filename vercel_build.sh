@@ -1,4 +1,5 @@
 #!/bin/bash
 pip install --upgrade pip
 pip install -r requirements.txt
-pip install soundfile --no-binary :all:
\ No newline at end of file
+pip install soundfile --no-binary :all:
+python static_assets.py
@@ -1,123 +1,287 @@
-import sys
 import os
-import numpy as np
-from basic_pitch.inference import predict as bp_predict
+from inference_engine import get_engine, DEFAULT_ENGINE
+from preprocessing import apply_preprocessing, reduce_noise, DEFAULT_PREPROCESS_MODE, NOISE_REDUCER
+from note_table import Transcription, as_transcription, merge_notes, pitch_class_histogram
+from key_analysis import analyze_key
+from musicxml_writer import render_musicxml
+from transcription_cache import get_cache, get_activation_store, cache_key, audio_fingerprint, quantize_activations
+from telemetry import span, configure_logging
 import librosa
 import pretty_midi
 import music21 as m21
-import traceback
-import time
 from tqdm import tqdm
 import soundfile as sf
-import pickle
 from collections import Counter
 import io
-import tempfile
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-def preprocess_audio(audio_path, skip_noise_reduction=True):
+logger = logging.getLogger(__name__)
+
+def preprocess_audio(audio_path, skip_noise_reduction=True, audio=None, preprocess_mode=DEFAULT_PREPROCESS_MODE):
     try:
-        highpass_path = audio_path.replace('.wav', '_highpass.wav')
-        if os.path.exists(highpass_path):
-            print(f"Using existing high-pass filtered audio: {highpass_path}", file=sys.stderr)
+        # Filtered audio is only cached on disk for file inputs; in-memory audio never touches disk
+        suffix = '_highpass.wav' if preprocess_mode == 'hpss' else f'_{preprocess_mode}.wav'
+        highpass_path = audio_path.replace('.wav', suffix) if audio_path and preprocess_mode != 'none' else None
+        if highpass_path and os.path.exists(highpass_path):
+            logger.info("Using existing filtered audio: %s", highpass_path)
             y, sr = librosa.load(highpass_path)
         else:
-            print(f"Attempting to load audio file: {audio_path}", file=sys.stderr)
-            y, sr = librosa.load(audio_path)
-            print(f"Audio file loaded successfully. Duration: {len(y)/sr:.2f} seconds", file=sys.stderr)
+            if audio is not None:
+                y, sr = audio
+            else:
+                logger.info("Attempting to load audio file: %s", audio_path)
+                y, sr = librosa.load(audio_path)
+            logger.info("Audio file loaded successfully. Duration: %.2f seconds", len(y) / sr)
             
-            print("Applying high-pass filter...", file=sys.stderr)
-            y_highpass = librosa.effects.hpss(y)[0]
+            logger.debug("Applying %s preprocessing...", preprocess_mode)
+            with span('preprocess'):
+                y_filtered, elapsed = apply_preprocessing(y, sr, preprocess_mode)
+            logger.info("%s preprocessing completed in %.2f seconds", preprocess_mode, elapsed)
             
-            # Save the high-pass filtered audio
-            sf.write(highpass_path, y_highpass, sr)
-            print(f"High-pass filtered audio saved to: {highpass_path}", file=sys.stderr)
-            y = y_highpass
+            if highpass_path:
+                # Save the filtered audio
+                sf.write(highpass_path, y_filtered, sr)
+                logger.info("Filtered audio saved to: %s", highpass_path)
+            y = y_filtered
 
         if not skip_noise_reduction:
-            print("Applying noise reduction (this may take a while)...", file=sys.stderr)
-            start_time = time.time()
-            
-            # Use a simpler noise reduction method
-            y = librosa.decompose.nn_filter(y, aggregate=np.median, metric='cosine', width=int(sr/2))
-            
-            end_time = time.time()
-            print(f"Noise reduction completed in {end_time - start_time:.2f} seconds", file=sys.stderr)
+            logger.debug("Applying spectral-gating noise reduction...")
+            with span('noise_reduction'):
+                y, elapsed = reduce_noise(y, sr)
+            logger.info("Noise reduction completed in %.2f seconds", elapsed)
         else:
-            print("Skipping noise reduction step.", file=sys.stderr)
+            logger.debug("Skipping noise reduction step.")
         
-        print("Preprocessing completed successfully.", file=sys.stderr)
+        logger.debug("Preprocessing completed successfully.")
         return y, sr
     except Exception as e:
-        print(f"Error in preprocess_audio: {str(e)}", file=sys.stderr)
-        print(traceback.format_exc(), file=sys.stderr)
+        logger.exception("Error in preprocess_audio: %s", e)
         raise
 
+def activations_key(audio, skip_noise_reduction, preprocess_mode=DEFAULT_PREPROCESS_MODE, engine=DEFAULT_ENGINE):
+    # Activations depend only on the audio, its preprocessing and the model, never on thresholds.
+    # For CREPE they are the per-frame pitch track.
+    return cache_key(audio_fingerprint(*audio),
+                     stage='activations',
+                     model=get_engine(engine).model_id,
+                     noise_reduction=None if skip_noise_reduction else NOISE_REDUCER,
+                     preprocess_mode=preprocess_mode)
+
+def load_activations(audio_path, skip_noise_reduction=False, audio=None, preprocess_mode=DEFAULT_PREPROCESS_MODE,
+                     engine=DEFAULT_ENGINE):
+    if audio is None:
+        logger.info("Loading audio file: %s", audio_path)
+        audio = librosa.load(audio_path)
+
+    store = get_activation_store()
+    key = activations_key(audio, skip_noise_reduction, preprocess_mode, engine)
+    activations = store.get(key)
+    if activations is not None:
+        logger.info("Loaded cached %s activations %s", engine, key[:12])
+        return key, activations
+
+    y, sr = preprocess_audio(audio_path, skip_noise_reduction, audio=audio, preprocess_mode=preprocess_mode)
+    logger.debug("Running %s prediction...", engine)
+    with span('inference'):
+        activations = quantize_activations(get_engine(engine).run_model(y, sr))
+    store.set(key, activations)
+    logger.info("%s activations cached under %s", engine, key[:12])
+    return key, activations
+
+def activations_engine(activations):
+    # The engine is recorded by what its activations hold: CREPE stores a pitch track
+    return 'crepe' if 'frequency' in activations else 'basic_pitch'
+
+def extract_notes(activations, onset_threshold=0.5, frame_threshold=0.3,
+                  minimum_note_length=0.058,
+                  minimum_frequency=65, maximum_frequency=2093,
+                  multiple_pitch_bends=False, melodia_trick=True,
+                  confidence_threshold=0.5):
+    # Notes before merging. Settings for the other engine are ignored, so one retune config fits
+    # either kind of activations.
+    with span('note_creation'):
+        if activations_engine(activations) == 'crepe':
+            _, midi_data, _ = get_engine('crepe').notes_from_output(activations,
+                                                                    confidence_threshold=confidence_threshold,
+                                                                    minimum_note_length=minimum_note_length,
+                                                                    minimum_frequency=minimum_frequency,
+                                                                    maximum_frequency=maximum_frequency)
+        else:
+            _, midi_data, _ = get_engine().notes_from_output(activations,
+                                                             onset_threshold=onset_threshold,
+                                                             frame_threshold=frame_threshold,
+                                                             minimum_note_length=minimum_note_length,
+                                                             minimum_frequency=minimum_frequency,
+                                                             maximum_frequency=maximum_frequency,
+                                                             multiple_pitch_bends=multiple_pitch_bends,
+                                                             melodia_trick=melodia_trick)
+    return as_transcription(midi_data)
+
+def notes_from_activations(activations, merge_max_gap=0.15, merge_min_duration=0.075, merge_pitch_tolerance=1,
+                           selection=None, **note_params):
+    # selection=(start, end) keeps only the notes within that stretch of the activations, in seconds
+    transcription = extract_notes(activations, **note_params)
+    if selection is not None:
+        transcription = transcription.sliced(*selection)
+    return merge_nearby_notes(transcription,
+                              max_gap=merge_max_gap,
+                              min_duration=merge_min_duration,
+                              pitch_tolerance=merge_pitch_tolerance)
+
+def retune_transcription(analysis_id, start_time=None, end_time=None, **config):
+    # Re-extract notes from stored activations with new thresholds; no audio or model needed.
+    # Returns (transcription, engine), or None once the activations have been evicted.
+    activations = get_activation_store().get(analysis_id)
+    if activations is None:
+        return None
+    selection = (start_time or 0.0, end_time or None) if start_time or end_time else None
+    return notes_from_activations(activations, selection=selection, **config), activations_engine(activations)
+
+def preview_key(audio_url, preprocess_mode=DEFAULT_PREPROCESS_MODE, engine=DEFAULT_ENGINE, stage='preview'):
+    # By URL rather than content: a preview URL always serves the same audio, and this lets a
+    # repeat request skip the download and decode too
+    return cache_key(f"url:{audio_url}",
+                     stage=stage,
+                     model=get_engine(engine).model_id,
+                     preprocess_mode=preprocess_mode)
+
+def load_preview_analysis(audio_url, preprocess_mode=DEFAULT_PREPROCESS_MODE, engine=DEFAULT_ENGINE):
+    return get_cache().get(preview_key(audio_url, preprocess_mode, engine))
+
+def transcribe_audio(audio, preprocess_mode=DEFAULT_PREPROCESS_MODE, engine=DEFAULT_ENGINE):
+    # Just this audio, start to finish; returns (analysis_id, merged transcription). The unmerged
+    # notes are cached on the decoded audio, so a repeat of the same selection skips the model too.
+    cache = get_cache()
+    key = cache_key(audio_fingerprint(*audio),
+                    stage='notes',
+                    model=get_engine(engine).model_id,
+                    preprocess_mode=preprocess_mode)
+    cached = cache.get(key)
+    if cached is None:
+        analysis_id, activations = load_activations(None, skip_noise_reduction=True, audio=audio,
+                                                    preprocess_mode=preprocess_mode, engine=engine)
+        cached = (analysis_id, extract_notes(activations))
+        cache.set(key, cached)
+        logger.info("%s notes cached under %s", engine, key[:12])
+    analysis_id, transcription = cached
+    return analysis_id, merge_nearby_notes(transcription)
+
+def analyze_preview(audio_url, audio, preprocess_mode=DEFAULT_PREPROCESS_MODE, engine=DEFAULT_ENGINE):
+    # Activations and unmerged notes for the whole preview, so any selection of it is a slice
+    analysis_id, activations = load_activations(None, skip_noise_reduction=True, audio=audio,
+                                                preprocess_mode=preprocess_mode, engine=engine)
+    analysis = {'analysis_id': analysis_id,
+                'notes': extract_notes(activations),
+                'duration': len(audio[0]) / audio[1]}
+    get_cache().set(preview_key(audio_url, preprocess_mode, engine), analysis)
+    logger.info("Preview analysis for %s cached under %s", audio_url, analysis_id[:12])
+    return analysis
+
+def transcribe_selection(analysis, start_time, end_time, merge_max_gap=0.15, merge_min_duration=0.075,
+                         merge_pitch_tolerance=1):
+    # Only merging, key detection and rendering depend on the selection
+    with span('slice'):
+        transcription = analysis['notes'].sliced(start_time or 0.0, end_time or None)
+    return merge_nearby_notes(transcription,
+                              max_gap=merge_max_gap,
+                              min_duration=merge_min_duration,
+                              pitch_tolerance=merge_pitch_tolerance)
+
 def examine_audio_and_prediction(audio_path, skip_noise_reduction=False, 
                                  onset_threshold=0.5, frame_threshold=0.3,
                                  minimum_note_length=0.058, 
                                  minimum_frequency=65, maximum_frequency=2093,
                                  multiple_pitch_bends=False, melodia_trick=True,
-                                 merge_max_gap=0.15, merge_min_duration=0.075, merge_pitch_tolerance=1):
+                                 merge_max_gap=0.15, merge_min_duration=0.075, merge_pitch_tolerance=1,
+                                 audio=None, preprocess_mode=DEFAULT_PREPROCESS_MODE,
+                                 engine=DEFAULT_ENGINE, confidence_threshold=0.5):
     try:
-        y, sr = preprocess_audio(audio_path, skip_noise_reduction)
+        if audio is None:
+            logger.info("Loading audio file: %s", audio_path)
+            audio = librosa.load(audio_path)
     except Exception as e:
-        print(f"Error in preprocess_audio: {str(e)}", file=sys.stderr)
+        logger.error("Error loading audio: %s", e)
         return None
 
     try:
-        # Create a filename for the cached Basic Pitch output
-        cache_filename = f"{audio_path}_basic_pitch_output.pkl"
-        
-        if os.path.exists(cache_filename):
-            print(f"Loading cached Basic Pitch output from {cache_filename}", file=sys.stderr)
-            with open(cache_filename, 'rb') as f:
-                model_output = pickle.load(f)
+        # Key the cached notes on the decoded audio and every parameter that affects them
+        cache = get_cache()
+        if engine == 'crepe':
+            note_params = dict(confidence_threshold=confidence_threshold,
+                               minimum_note_length=minimum_note_length,
+                               minimum_frequency=minimum_frequency,
+                               maximum_frequency=maximum_frequency)
         else:
-            # Create a temporary file for the preprocessed audio
-            temp_path = audio_path.replace('.wav', '_preprocessed.wav')
-            print(f"Writing preprocessed audio to temporary file: {temp_path}", file=sys.stderr)
-            sf.write(temp_path, y, sr)
-
-            print("Running Basic Pitch prediction...", file=sys.stderr)
-            model_output = bp_predict(temp_path,
-                                      onset_threshold=onset_threshold,
-                                      frame_threshold=frame_threshold,
-                                      minimum_note_length=minimum_note_length,
-                                      minimum_frequency=minimum_frequency,
-                                      maximum_frequency=maximum_frequency,
-                                      multiple_pitch_bends=multiple_pitch_bends,
-                                      melodia_trick=melodia_trick)
-            
-            # Save the model output
-            with open(cache_filename, 'wb') as f:
-                pickle.dump(model_output, f)
-            print(f"Basic Pitch output saved to {cache_filename}", file=sys.stderr)
-            
-            # Remove the temporary file
-            os.remove(temp_path)
-            print("Temporary file removed.", file=sys.stderr)
+            note_params = dict(onset_threshold=onset_threshold,
+                               frame_threshold=frame_threshold,
+                               minimum_note_length=minimum_note_length,
+                               minimum_frequency=minimum_frequency,
+                               maximum_frequency=maximum_frequency,
+                               multiple_pitch_bends=multiple_pitch_bends,
+                               melodia_trick=melodia_trick)
+        key = cache_key(audio_fingerprint(*audio),
+                        model=get_engine(engine).model_id,
+                        noise_reduction=None if skip_noise_reduction else NOISE_REDUCER,
+                        preprocess_mode=preprocess_mode,
+                        **note_params)
+        model_output = cache.get(key)
+
+        if model_output is None:
+            try:
+                analysis_id, activations = load_activations(audio_path, skip_noise_reduction, audio=audio,
+                                                            preprocess_mode=preprocess_mode, engine=engine)
+            except Exception as e:
+                logger.error("Error in preprocess_audio: %s", e)
+                return None
+
+            # Only the notes go in this cache; the activations already live in the activation store
+            with span('note_creation'):
+                _, midi_data, note_events = get_engine(engine).notes_from_output(activations, **note_params)
+            model_output = (analysis_id, midi_data, note_events)
+            cache.set(key, model_output)
+            logger.info("%s notes cached under %s", engine, key[:12])
         
-        print(f"Type of model_output: {type(model_output)}", file=sys.stderr)
+        logger.debug("Type of model_output: %s", type(model_output))
         
         if isinstance(model_output, tuple) and len(model_output) >= 2:
             midi_data = model_output[1]
-            if isinstance(midi_data, pretty_midi.PrettyMIDI):
-                print("MIDI data extracted successfully", file=sys.stderr)
+            # Basic Pitch returns PrettyMIDI, CREPE a note table
+            if isinstance(midi_data, (pretty_midi.PrettyMIDI, Transcription)):
+                logger.debug("MIDI data extracted successfully")
                 midi_data = merge_nearby_notes(midi_data, 
                                                max_gap=merge_max_gap, 
                                                min_duration=merge_min_duration, 
                                                pitch_tolerance=merge_pitch_tolerance)
                 return midi_data
             else:
-                print(f"Unexpected format for MIDI data: {type(midi_data)}", file=sys.stderr)
+                logger.error("Unexpected format for MIDI data: %s", type(midi_data))
         else:
-            print(f"Unexpected model output format: {type(model_output)}", file=sys.stderr)
+            logger.error("Unexpected model output format: %s", type(model_output))
         
         return None
     except Exception as e:
-        print(f"Error in examine_audio_and_prediction: {str(e)}", file=sys.stderr)
-        print(traceback.format_exc(), file=sys.stderr)
+        logger.exception("Error in examine_audio_and_prediction: %s", e)
+        return None
+
+def _transcribe_stem(audio_path, config):
+    if not audio_path or not os.path.exists(audio_path):
         return None
+    return examine_audio_and_prediction(audio_path, skip_noise_reduction=True, **config)
+
+def transcribe_stems(stem_paths, config, max_workers=None):
+    # Preprocessing and inference are CPU bound and hold the GIL for much of the work, so each
+    # stem gets its own process (and core). Results come back in stem order, None for a missing stem.
+    stem_paths = list(stem_paths)
+    max_workers = min(max_workers or os.cpu_count() or 1, sum(1 for path in stem_paths if path and os.path.exists(path)))
+    if max_workers <= 1:
+        return [_transcribe_stem(path, config) for path in stem_paths]
+    logger.info("Transcribing %d stems in %d processes", len(stem_paths), max_workers)
+    # spawn rather than fork: a forked TensorFlow runtime isn't safe to reuse
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as executor:
+        return list(executor.map(_transcribe_stem, stem_paths, [config] * len(stem_paths)))
 
 def quantize_duration_16th(duration):
     if duration < 0.5:  # Less than 8th note
@@ -153,43 +317,54 @@ def quantize_duration_extended(duration):
     else:  # Longer than dotted whole note
         return round(duration / 1.0) * 1.0  # Round to nearest quarter note
 
-def create_part_from_midi(midi_data, part_name, quantize_func, detect_silence=False):
-    part = m21.stream.Part()
-    part.partName = part_name
-    
+def quantized_events(midi_data, quantize_func, detect_silence=False):
+    # The part as it will be notated: [(midi pitch or None for a rest, quarter length), ...] back to back
+    transcription = as_transcription(midi_data)
+    events = []
     last_end_time = 0
-    for instrument in midi_data.instruments:
-        for note in instrument.notes:
-            if detect_silence:
-                # Add a rest if there's a gap
-                if note.start > last_end_time:
-                    rest_duration = note.start - last_end_time
-                    rest = m21.note.Rest()
-                    rest.quarterLength = quantize_func(rest_duration)
-                    if rest.quarterLength > 0:
-                        part.append(rest)
-            
-            duration = note.end - note.start
-            quantized_duration = quantize_func(duration)
-            
-            m21_note = m21.note.Note(note.pitch)
-            m21_note.quarterLength = quantized_duration
-            part.append(m21_note)
-            
-            last_end_time = note.end
+    # Notes are already grouped by track, in the same order as the instruments they came from
+    for start, end, pitch in zip(transcription.notes['start'].tolist(),
+                                 transcription.notes['end'].tolist(),
+                                 transcription.notes['pitch'].tolist()):
+        if detect_silence:
+            # Add a rest if there's a gap
+            if start > last_end_time:
+                rest_duration = quantize_func(start - last_end_time)
+                if rest_duration > 0:
+                    events.append((None, rest_duration))
+        
+        events.append((pitch, quantize_func(end - start)))
+        last_end_time = end
     
     if detect_silence:
         # Add a final rest if needed
-        if last_end_time < midi_data.get_end_time():
-            final_rest_duration = midi_data.get_end_time() - last_end_time
-            final_rest = m21.note.Rest()
-            final_rest.quarterLength = quantize_func(final_rest_duration)
-            if final_rest.quarterLength > 0:
-                part.append(final_rest)
+        if last_end_time < transcription.get_end_time():
+            final_rest_duration = quantize_func(transcription.get_end_time() - last_end_time)
+            if final_rest_duration > 0:
+                events.append((None, final_rest_duration))
+    
+    return events
+
+def create_part_from_midi(midi_data, part_name, quantize_func, detect_silence=False):
+    part = m21.stream.Part()
+    part.partName = part_name
+    
+    for pitch, quarter_length in quantized_events(midi_data, quantize_func, detect_silence):
+        element = m21.note.Rest() if pitch is None else m21.note.Note(pitch)
+        element.quarterLength = quarter_length
+        part.append(element)
     
     return part
 
-def create_sheet_music(lead_midi, harmony_midi, output_path, quantize_func, suffix, include_harmony=False, input_filename=''):
+def harmony_parts(harmony_midi):
+    # A single harmony stem, or a list of them (e.g. from transcribe_stems); each becomes its own part
+    stems = harmony_midi if isinstance(harmony_midi, (list, tuple)) else [harmony_midi]
+    stems = [stem for stem in stems if stem is not None]
+    if len(stems) == 1:
+        return [("Harmony Vocal", stems[0])]
+    return [(f"Harmony Vocal {i}", stem) for i, stem in enumerate(stems, 1)]
+
+def create_music21_score(lead_midi, harmony_midi, quantize_func, include_harmony=False):
     score = m21.stream.Score()
 
     key = detect_key(lead_midi)
@@ -206,8 +381,8 @@ def create_sheet_music(lead_midi, harmony_midi, output_path, quantize_func, suff
     
     score.append(lead_part)
     
-    if include_harmony and harmony_midi:
-        harmony_part = create_part_from_midi(harmony_midi, "Harmony Vocal", quantize_func, detect_silence=True)
+    for part_name, midi in (harmony_parts(harmony_midi) if include_harmony and harmony_midi else []):
+        harmony_part = create_part_from_midi(midi, part_name, quantize_func, detect_silence=True)
         harmony_part.insert(0, m21.instrument.Instrument())
         harmony_part.insert(0, m21.meter.TimeSignature('4/4'))
         harmony_part.insert(0, key)
@@ -225,29 +400,61 @@ def create_sheet_music(lead_midi, harmony_midi, output_path, quantize_func, suff
     
     # Clean up the score
     score.makeNotation(inPlace=True)
+    return score
+
+def render_fast_musicxml(lead_midi, harmony_midi, quantize_func, include_harmony=False):
+    # Same parts, key and 4/4 time as the music21 score, written directly without building streams
+    key = analyze_key(lead_midi)[0]
+    logger.info("Detected key: %s", key.name)
+    parts = [("Lead Vocal", quantized_events(lead_midi, quantize_func, detect_silence=False))]
+    # render_musicxml pads every part with measure rests to the longest, so measures stay aligned
+    for part_name, midi in (harmony_parts(harmony_midi) if include_harmony and harmony_midi else []):
+        parts.append((part_name, quantized_events(midi, quantize_func, detect_silence=True)))
+    return render_musicxml(parts, fifths=key.sharps, mode=key.mode, time_signature=(4, 4))
+
+def create_sheet_music(lead_midi, harmony_midi, output_path, quantize_func, suffix, include_harmony=False, input_filename='',
+                       renderer=None):
+    # 'fast' writes MusicXML directly; 'music21' builds a music21 score. The fast writer falls
+    # back to music21 if it fails for any reason.
+    renderer = renderer or os.environ.get('SHEET_MUSIC_RENDERER', 'fast')
+    musicxml = None
+    if renderer == 'fast':
+        try:
+            with span('musicxml_render'):
+                musicxml = render_fast_musicxml(lead_midi, harmony_midi, quantize_func, include_harmony)
+        except Exception as e:
+            logger.warning("Fast MusicXML renderer failed, falling back to music21: %s", e)
     
     # Write the score to a file or return as string
     if output_path == "memory":
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as temp_file:
-            score.write('musicxml', temp_file.name)
-        
-        with open(temp_file.name, 'r') as file:
-            musicxml_content = file.read()
-        
-        os.unlink(temp_file.name)
-        return musicxml_content
+        if musicxml is not None:
+            return musicxml
+        with span('music21_build'):
+            score = create_music21_score(lead_midi, harmony_midi, quantize_func, include_harmony)
+        # Serialize straight to bytes instead of round-tripping through a temp file
+        with span('music21_serialize'):
+            return m21.musicxml.m21ToXml.GeneralObjectExporter(score).parse().decode('utf-8')
     else:
         output_filename = f"{os.path.splitext(input_filename)[0]}_{suffix}.xml"
         output_path_with_suffix = os.path.join(os.path.dirname(output_path), output_filename)
-        score.write('musicxml', output_path_with_suffix)
-        print(f"Sheet music created: {output_path_with_suffix}")
+        if musicxml is not None:
+            with open(output_path_with_suffix, 'w', encoding='utf-8') as f:
+                f.write(musicxml)
+        else:
+            with span('music21_build'):
+                score = create_music21_score(lead_midi, harmony_midi, quantize_func, include_harmony)
+            with span('music21_serialize'):
+                score.write('musicxml', output_path_with_suffix)
+        logger.info("Sheet music created: %s", output_path_with_suffix)
 
 def test_configuration(lead_path, harmony_path, output_path, config, config_name):
     print(f"\nTesting configuration: {config_name}")
-    lead_midi = examine_audio_and_prediction(lead_path, skip_noise_reduction=True, **config)
-    harmony_midi = examine_audio_and_prediction(harmony_path, skip_noise_reduction=True, **config) if os.path.exists(harmony_path) else None
+    # One harmony stem or several; all stems are transcribed concurrently, one process each
+    harmony_paths = [harmony_path] if isinstance(harmony_path, str) else list(harmony_path)
+    lead_midi, *harmony_midis = transcribe_stems([lead_path] + harmony_paths, config)
+    harmony_midi = [midi for midi in harmony_midis if midi is not None] or None
     
-    if lead_midi:
+    if lead_midi is not None:
         try:
             print("Key detection for lead vocal:")
             print_top_key_candidates(lead_midi)
@@ -259,8 +466,9 @@ def test_configuration(lead_path, harmony_path, output_path, config, config_name
             
             # Lead and harmony vocals, extended notes
             if harmony_midi:
-                print("\nKey detection for harmony vocal:")
-                print_top_key_candidates(harmony_midi)
+                for part_name, midi in harmony_parts(harmony_midi):
+                    print(f"\nKey detection for {part_name.lower()}:")
+                    print_top_key_candidates(midi)
                 create_sheet_music(lead_midi, harmony_midi, output_path, quantize_duration_extended, f"extended_lead_and_harmony_{config_name}", include_harmony=True, input_filename=input_filename)
             
             print(f"Sheet music created for configuration {config_name}")
@@ -270,103 +478,40 @@ def test_configuration(lead_path, harmony_path, output_path, config, config_name
         print(f"Failed to create sheet music for configuration {config_name} due to errors in MIDI data extraction.")
 
 def merge_nearby_notes(midi_data, max_gap=0.15, min_duration=0.075, pitch_tolerance=1):
+    transcription = as_transcription(midi_data)
     try:
-        key = detect_key(midi_data)
+        key = detect_key(transcription)
         scale = key.getScale()
         scale_pitches = [note.midi % 12 for note in scale.getPitches()]
     except Exception as e:
-        print(f"Error in key detection: {str(e)}")
-        print("Proceeding without key-based filtering")
+        logger.warning("Error in key detection: %s. Proceeding without key-based filtering", e)
         scale_pitches = list(range(12))  # Consider all pitches as in-scale
     
-    for instrument in midi_data.instruments:
-        merged_notes = []
-        current_note = None
-        for note in instrument.notes:
-            if current_note is None:
-                current_note = note
-            elif (abs(note.pitch - current_note.pitch) <= pitch_tolerance and 
-                  note.start - current_note.end <= max_gap):
-                # Merge notes if they're close in pitch and time
-                current_note.end = max(current_note.end, note.end)
-                current_note.velocity = max(current_note.velocity, note.velocity)
-                # If the new note is in the scale and the current note isn't, update the pitch
-                if note.pitch % 12 in scale_pitches and current_note.pitch % 12 not in scale_pitches:
-                    current_note.pitch = note.pitch
-            else:
-                if current_note.end - current_note.start >= min_duration:
-                    merged_notes.append(current_note)
-                current_note = note
-        if current_note is not None and current_note.end - current_note.start >= min_duration:
-            merged_notes.append(current_note)
-        
-        # Filter out notes that are not in the key, unless they're longer than a threshold
-        key_notes = []
-        for note in merged_notes:
-            if note.pitch % 12 in scale_pitches or note.end - note.start > 0.5:  # 0.5 seconds threshold
-                key_notes.append(note)
-        
-        instrument.notes = key_notes
-    return midi_data
+    # Merge notes close in pitch and time, drop short ones, then drop out-of-key notes
+    # unless they're longer than 0.5 seconds
+    with span('merge'):
+        return transcription.with_notes(merge_notes(transcription.notes, scale_pitches,
+                                                    max_gap=max_gap, min_duration=min_duration,
+                                                    pitch_tolerance=pitch_tolerance))
 
 def calculate_pitch_histogram(midi_data):
-    pitch_hist = np.zeros(12)
-    for instrument in midi_data.instruments:
-        for note in instrument.notes:
-            pitch_class = note.pitch % 12
-            duration = note.end - note.start
-            pitch_hist[pitch_class] += duration
-    return pitch_hist / np.sum(pitch_hist)  # Normalize histogram
+    return pitch_class_histogram(as_transcription(midi_data))
 
 def detect_key(midi_data):
-    # Krumhansl-Schmuckler key profiles
-    major_profile = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
-    minor_profile = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
-
-    pitch_hist = calculate_pitch_histogram(midi_data)
-
-    # Calculate correlation with each possible key
-    correlations = []
-    for i in range(12):
-        major_corr = np.correlate(np.roll(pitch_hist, -i), major_profile)
-        minor_corr = np.correlate(np.roll(pitch_hist, -i), minor_profile)
-        correlations.append((major_corr[0], 'major'))
-        correlations.append((minor_corr[0], 'minor'))
-
-    # Find the key with the highest correlation
-    best_key = max(correlations, key=lambda x: x[0])
-    tonic = correlations.index(best_key) // 2
-    mode = best_key[1]
-
-    tonic_name = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'][tonic]
-    print(f"Detected key: {tonic_name} {mode}")
+    # Ranked once per transcription and memoized, so later stages reuse the same analysis
+    best = analyze_key(midi_data)[0]
+    logger.info("Detected key: %s", best.name)
 
     # Create a music21 key object
-    return m21.key.Key(tonic_name, mode)
+    return best.to_music21()
 
 def print_top_key_candidates(midi_data):
-    major_profile = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
-    minor_profile = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
-
-    pitch_hist = calculate_pitch_histogram(midi_data)
-
-    correlations = []
-    for i in range(12):
-        major_corr = np.correlate(np.roll(pitch_hist, -i), major_profile)
-        minor_corr = np.correlate(np.roll(pitch_hist, -i), minor_profile)
-        correlations.append((major_corr[0], i, 'major'))
-        correlations.append((minor_corr[0], i, 'minor'))
-
-    # Sort correlations in descending order
-    sorted_correlations = sorted(correlations, key=lambda x: x[0], reverse=True)
-
     print("Top 3 key candidates:")
-    for i in range(3):
-        corr, tonic, mode = sorted_correlations[i]
-        tonic_name = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'][tonic]
-        print(f"{i+1}. {tonic_name} {mode} (correlation: {corr:.4f})")
+    for i, candidate in enumerate(analyze_key(midi_data)[:3]):
+        print(f"{i+1}. {candidate.name} (correlation: {candidate.score:.4f})")
 
 def main():
+    configure_logging()
     output_dir = "data/extracted_audio"
     lead_path = os.path.join(output_dir, "billyjeanlead.wav")
     harmony_path = os.path.join(output_dir, "billyjeanharmony.wav")